@@ -1,9 +1,28 @@
 #!/bin/bash
 
-python -u -m "muzeeglot.ingest"
+# NOTE: MODE is either `all` (ingest then serve), `ingest` or `api`.
+MODE="${MODE:-all}"
 
+# NOTE: a dedicated ingestion job always publishes a new bundle.
+if [ "$MODE" = "ingest" ]; then
+    python -u -m "muzeeglot.ingest" --republish
+    exit $?
+fi
+if [ "$MODE" != "api" ]; then
+    python -u -m "muzeeglot.ingest" || exit 1
+fi
+
+# NOTE: workers share their metrics through this directory, which is reset
+#       as worker snapshots are only meaningful for this gunicorn instance.
+export METRICS_DIRECTORY="${METRICS_DIRECTORY:-/tmp/muzeeglot-metrics}"
+rm -rf "$METRICS_DIRECTORY"
+mkdir -p "$METRICS_DIRECTORY"
+
+# NOTE: workers only notify gunicorn once started, thus blocking warm-up must
+#       fit within worker timeout.
 GUNICORN_OPTS="${GUNICORN_OPTS} --workers=4"
+GUNICORN_OPTS="${GUNICORN_OPTS} --timeout=${WARMUP_TIMEOUT:-120}"
 GUNICORN_OPTS="${GUNICORN_OPTS} --bind=0.0.0.0:80"
 GUNICORN_OPTS="${GUNICORN_OPTS} --worker-class=uvicorn.workers.UvicornWorker"
 
-gunicorn $GUNICORN_OPTS "muzeeglot:api"
\ No newline at end of file
+gunicorn $GUNICORN_OPTS "muzeeglot:api"
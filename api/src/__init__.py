@@ -3,29 +3,44 @@
 
 """ API specification. """
 
-from functools import partial
-from os.path import exists
+import logging
+import random
+import time
+
+from os.path import exists, join
+from threading import Event, Thread
 from typing import Any, Dict, List
 
-from fastapi import FastAPI, status
-from fastapi.responses import FileResponse
-from fastapi.logger import logger
+from fastapi import FastAPI, HTTPException, Query, Request, status
+from fastapi.responses import FileResponse, PlainTextResponse, Response
 from pydantic import BaseModel, conint
 from redis import Redis
 from whoosh.index import open_dir
 from whoosh.qparser import QueryParser
 
-from . import configuration
+from . import artifacts, configuration
 from .mapper import GenreMapper
-from .storage import storage
-from .types import Language, Tags, Entity, EntityId
+from .metrics import Metrics
+from .normalization import Normalizer
+from .similarity import SimilarityIndex
+from .storage import replica, storage
+from .types import Language, Locale, Tags, TagDictionary, Entity, EntityId
 
 api = FastAPI(docs_url=None, redoc_url=None)
 """ API instance. """
 
+logger = logging.getLogger('uvicorn.error')
+""" API logger, configured at INFO level by uvicorn and gunicorn workers. """
+
 index = None
 """ Entity name search index. """
 
+similarities: SimilarityIndex = None
+""" Entity similarity index. """
+
+ready: Event = Event()
+""" Flag set once worker warm-up is done. """
+
 
 class SearchQuery(BaseModel):
     """ Request body model for entity search query. """
@@ -37,18 +52,96 @@ class SearchQuery(BaseModel):
 
 class PredictModel(BaseModel):
     """ Request body model for prediction query. """
-    sources: List[str]
-    target: str
+    sources: List[Locale]
+    target: Locale
     eid: EntityId
 
 
 @api.on_event('startup')
 def on_startup():
     """ Callback function for server startup. """
-    global index
-    if not exists(configuration.INDEX):
+    global index, similarities
+    if configuration.METRICS_DIRECTORY:
+        Metrics.share(
+            configuration.METRICS_DIRECTORY,
+            configuration.METRICS_FLUSH_INTERVAL)
+    directory = artifacts.resolve()
+    if not exists(directory):
         raise IOError('Entity index not found')
-    index = open_dir(configuration.INDEX)
+    index = open_dir(directory)
+    Normalizer.load(join(directory, Normalizer.FILENAME))
+    try:
+        similarities = SimilarityIndex(directory)
+    except IOError:
+        logger.warning('Entity similarity index not found')
+    GenreMapper.directory = directory
+    if configuration.WARMUP == 'background':
+        Thread(target=warmup, daemon=True).start()
+    elif configuration.WARMUP == 'blocking':
+        warmup()
+    else:
+        ready.set()
+
+
+def warmup():
+    """ Loads embeddings and builds mappers for configured and most requested
+    language pairs, then flags this worker as ready. Mappers are only built
+    during the first half of `WARMUP_TIMEOUT`, so that gunicorn does not kill
+    a blocking worker before it starts. """
+    logger.info('Worker warm-up started')
+    deadline = time.perf_counter() + configuration.WARMUP_TIMEOUT / 2
+    try:
+        GenreMapper.ensure_embeddings()
+    except Exception:
+        logger.exception('Unable to load embeddings, worker not ready')
+        return
+    if (
+            configuration.STORAGE_LAYOUT == 'compact'
+            and len(TagDictionary.load()) == 0):
+        logger.error('Tag dictionary is empty, worker not ready')
+        return
+    popular = [
+        key.decode()
+        for key in replica.zrevrange(
+            configuration.POPULARITY_KEY,
+            0,
+            configuration.WARMUP_POPULAR - 1)]
+    keys = list(dict.fromkeys(configuration.WARMUP_PAIRS + popular))
+    supported = Language.locales()
+    for i, key in enumerate(keys):
+        if time.perf_counter() > deadline:
+            logger.warning(
+                f'Warm-up time budget exceeded, skip {len(keys) - i} mappers')
+            keys = keys[:i]
+            break
+        try:
+            sources, target = GenreMapper.parse_key(key)
+            locales = sources + [target]
+            if any([locale not in supported for locale in locales]):
+                raise ValueError(f'Unsupported locale in mapper key {key}')
+            GenreMapper.get(sources, target, Tags.from_locale)
+        except Exception:
+            logger.warning(f'Unable to warm-up mapper {key}', exc_info=True)
+    logger.info(f'Worker warm-up done ({len(keys)} mappers)')
+    ready.set()
+
+
+@api.middleware('http')
+async def instrument(request: Request, call_next):
+    """ Middleware that collects per request metrics. """
+    context = Metrics.begin()
+    start = time.perf_counter()
+    response = await call_next(request)
+    seconds = time.perf_counter() - start
+    endpoint = request.scope.get('endpoint')
+    endpoint = endpoint.__name__ if endpoint is not None else 'unmatched'
+    Metrics.end(endpoint, context, seconds)
+    if random.random() < configuration.METRICS_LOG_SAMPLING:
+        logger.info(
+            f'{request.method} {request.url.path} '
+            f'{response.status_code} {seconds * 1000:.2f}ms '
+            f'{Metrics.summary(context)}')
+    return response
 
 
 @api.get('/heartbeat', status_code=status.HTTP_200_OK)
@@ -57,6 +150,20 @@ def heartbeat():
     pass
 
 
+@api.get('/ready')
+def get_ready() -> Response:
+    """ GET /ready endpoint. """
+    if ready.is_set():
+        return Response(status_code=status.HTTP_200_OK)
+    return Response(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+@api.get('/metrics', response_class=PlainTextResponse)
+def metrics() -> str:
+    """ GET /metrics endpoint. """
+    return Metrics.render()
+
+
 @api.get('/languages')
 def get_languages() -> List[Dict[str, str]]:
     """ GET /languages endpoint. """
@@ -69,6 +176,26 @@ def get_entity(eid: EntityId) -> Dict[str, Any]:
     return Entity.get(eid)
 
 
+@api.get('/similar/{eid}')
+def get_similar(
+        eid: EntityId,
+        target: Locale,
+        sources: List[Locale] = Query(...),
+        k: conint(ge=1, le=100) = 10) -> List[Dict[str, Any]]:
+    """ GET /similar/{eid} endpoint. """
+    if similarities is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    with Metrics.span('similar.search'):
+        try:
+            return similarities.search(eid, sources, target, k)
+        except KeyError:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+        except ValueError as error:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(error))
+
+
 @api.get('/embeddings')
 def get_embeddings() -> FileResponse:
     """ GET /embeddings endpoint. """
@@ -84,22 +211,45 @@ def search(request: SearchQuery) -> List[Dict[str, Any]]:
     query = f"ngram:'{query}' AND {clauses}"
     parser = QueryParser(['ngram'], schema=index.schema)
     query = parser.parse(query)
-    with index.searcher() as searcher:
+    with Metrics.span('search.whoosh'), index.searcher() as searcher:
         return [
             {'eid': hit['eid'], 'label': hit['name']}
             for hit in searcher.search_page(query, request.page, pagelen=20)]
 
 
+def record_popularity(sources: List[str], target: str) -> None:
+    """ Counts a request of the given mapper in popularity, if every locale
+    is supported so that clients can not grow it with arbitrary keys.
+
+    Parameters
+    ----------
+    sources: List[str]
+        List of source languages to map genre from.
+    target: str
+        Target language to map genre to.
+    """
+    supported = Language.locales()
+    if all([locale in supported for locale in sources + [target]]):
+        storage.zincrby(
+            configuration.POPULARITY_KEY,
+            1,
+            GenreMapper.key(sources, target))
+
+
 @api.post('/predict')
 def predict(request: PredictModel) -> List[str]:
     """ GET /predict endpoint. """
     sources = request.sources
     target = request.target
-    mapper = GenreMapper.get(sources, target, Tags.from_locale)
-    tfilter = partial(storage.sismember, f'tags:{target}')
-    predictions = mapper.predict([
-        tag
-        for source in sources
-        for tag in Tags.from_entities(request.eid, source)],
-        tfilter)
+    with Metrics.span('predict.mapper'):
+        mapper = GenreMapper.get(sources, target, Tags.from_locale)
+    if random.random() < configuration.POPULARITY_SAMPLING:
+        record_popularity(sources, target)
+    tfilter = Tags.filter(target)
+    with Metrics.span('predict.redis'):
+        tags = [
+            tag
+            for source in sources
+            for tag in Tags.from_entities(request.eid, source)]
+    predictions = mapper.predict(tags, tfilter)
     return predictions[:10]
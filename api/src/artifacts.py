@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Versioned artifact bundles shared between ingestion job and API nodes.
+
+A bundle is a directory `{ARTIFACTS}/{version}` containing the Whoosh search
+index, the normalization cache, the binary embeddings and the precomputed
+mapping tables. The `{ARTIFACTS}/LATEST` file holds the name of the latest
+published version. When `ARTIFACTS` is not set, artifacts are written next to
+the search index into `INDEX_DIRECTORY`, which is the legacy single node
+behavior.
+
+Each bundle stores its Redis data into its own database, recorded as
+`redis_db` in its manifest along with the storage `layout`, so that ingesting
+a new version never alters data served by nodes still using a previous one.
+"""
+
+import json
+import time
+
+from os import listdir, makedirs, replace, rename
+from os.path import exists, join
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from redis import Redis
+from sklearn.metrics.pairwise import cosine_similarity
+
+from . import configuration
+from .storage import select
+
+LATEST = 'LATEST'
+""" Name of the file pointing to latest published version. """
+
+MANIFEST = 'manifest.json'
+""" Name of the bundle manifest file. """
+
+TAGS = 'tags.json'
+""" Name of the embeddings tag labels file. """
+
+EMBEDDINGS = 'embeddings.npy'
+""" Name of the binary embeddings file. """
+
+SIMILARITIES = 'similarities.npy'
+""" Name of the precomputed cosine similarity table file. """
+
+
+def latest() -> Optional[str]:
+    """ Returns the latest published version if any.
+
+    Returns
+    -------
+    version: Optional[str]
+        Latest version, `None` if no bundle was published yet.
+    """
+    path = join(configuration.ARTIFACTS, LATEST)
+    if not exists(path):
+        return None
+    with open(path, 'r') as stream:
+        return stream.read().strip()
+
+
+def locate() -> str:
+    """ Locates the artifact directory of the configured version.
+
+    Returns
+    -------
+    directory: str
+        Path of the directory to load artifacts from.
+
+    Raises
+    ------
+    IOError
+        If no bundle is available for the configured version.
+    """
+    if not configuration.ARTIFACTS:
+        return configuration.INDEX
+    version = configuration.ARTIFACTS_VERSION
+    if version == 'latest':
+        version = latest()
+        if version is None:
+            raise IOError('No artifact bundle published')
+    directory = join(configuration.ARTIFACTS, version)
+    if not exists(join(directory, MANIFEST)):
+        raise IOError(f'Artifact bundle {version} not found')
+    return directory
+
+
+def read_manifest(directory: str) -> Dict[str, Any]:
+    """ Reads the manifest of the given bundle.
+
+    Parameters
+    ----------
+    directory: str
+        Bundle directory.
+
+    Returns
+    -------
+    manifest: Dict[str, Any]
+        Bundle manifest.
+    """
+    with open(join(directory, MANIFEST), 'r') as stream:
+        return json.load(stream)
+
+
+def write_manifest(directory: str, manifest: Dict[str, Any]) -> None:
+    """ Atomically writes the manifest of the given bundle.
+
+    Parameters
+    ----------
+    directory: str
+        Bundle directory.
+    manifest: Dict[str, Any]
+        Bundle manifest.
+    """
+    path = join(directory, f'.{MANIFEST}')
+    with open(path, 'w') as stream:
+        json.dump(manifest, stream, indent=2)
+    replace(path, join(directory, MANIFEST))
+
+
+def attach(directory: str) -> None:
+    """ Binds storage clients to the database of the given bundle. Bundles
+    published before databases were recorded use database `0`.
+
+    Parameters
+    ----------
+    directory: str
+        Bundle directory.
+    """
+    if configuration.ARTIFACTS:
+        select(read_manifest(directory).get('redis_db', 0))
+
+
+def resolve() -> str:
+    """ Resolves the artifact directory to be used by API nodes, and binds
+    storage clients to its database.
+
+    Returns
+    -------
+    directory: str
+        Path of the directory to load artifacts from.
+
+    Raises
+    ------
+    IOError
+        If no bundle is available for the configured version.
+    ValueError
+        If bundle was ingested with another storage layout than the
+        configured one.
+    """
+    directory = locate()
+    if configuration.ARTIFACTS:
+        layout = read_manifest(directory).get('layout', 'legacy')
+        if layout != configuration.STORAGE_LAYOUT:
+            raise ValueError(
+                f'Artifact bundle {directory} uses {layout} storage layout '
+                f'whereas STORAGE_LAYOUT is {configuration.STORAGE_LAYOUT}')
+        attach(directory)
+    return directory
+
+
+def allocate() -> int:
+    """ Allocates the storage database of a new bundle, which is the first
+    empty database not recorded by any published bundle. Database `0` is
+    left to single node mode.
+
+    Returns
+    -------
+    db: int
+        Index of the allocated database.
+
+    Raises
+    ------
+    IOError
+        If no database is available.
+    """
+    used = set()
+    for name in listdir(configuration.ARTIFACTS):
+        directory = join(configuration.ARTIFACTS, name)
+        if exists(join(directory, MANIFEST)):
+            used.add(read_manifest(directory).get('redis_db', 0))
+    for db in range(1, configuration.REDIS_DATABASES):
+        client = Redis(host=configuration.REDIS_HOST, db=db)
+        if db not in used and client.dbsize() == 0:
+            return db
+    raise IOError(
+        'No storage database available, remove outdated bundles '
+        'and flush their database')
+
+
+def version() -> str:
+    """ Returns the version to be published by the ingestion job, either the
+    configured one or a timestamp based one if `latest` is configured.
+
+    Returns
+    -------
+    version: str
+        Version to publish.
+    """
+    if configuration.ARTIFACTS_VERSION == 'latest':
+        return time.strftime('%Y%m%d%H%M%S')
+    return configuration.ARTIFACTS_VERSION
+
+
+def staging(version: str) -> str:
+    """ Creates and returns the staging directory of the given version.
+
+    Parameters
+    ----------
+    version: str
+        Version to stage.
+
+    Returns
+    -------
+    directory: str
+        Path of the staging directory.
+    """
+    directory = join(configuration.ARTIFACTS, f'.staging-{version}')
+    makedirs(directory, exist_ok=True)
+    return directory
+
+
+def publish(
+        directory: str,
+        version: str,
+        files: List[str],
+        db: int) -> None:
+    """ Writes bundle manifest then atomically publishes the given staging
+    directory as the latest version.
+
+    Parameters
+    ----------
+    directory: str
+        Staging directory to publish.
+    version: str
+        Published version.
+    files: List[str]
+        Artifact files contained in the bundle.
+    db: int
+        Storage database the bundle data was ingested into.
+    """
+    write_manifest(directory, {
+        'version': version,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'layout': configuration.STORAGE_LAYOUT,
+        'redis_db': db,
+        'files': files})
+    rename(directory, join(configuration.ARTIFACTS, version))
+    pointer = join(configuration.ARTIFACTS, f'.{LATEST}')
+    with open(pointer, 'w') as stream:
+        stream.write(version)
+    replace(pointer, join(configuration.ARTIFACTS, LATEST))
+
+
+def write_tables(directory: str) -> List[str]:
+    """ Converts CSV embeddings into binary embeddings, and precomputes the
+    cosine similarity table used by `GenreMapper`.
+
+    Parameters
+    ----------
+    directory: str
+        Directory to write tables into.
+
+    Returns
+    -------
+    files: List[str]
+        Names of written files.
+    """
+    path = configuration.EMBEDDINGS
+    if not exists(path):
+        raise IOError(f'Embeddings file {path} not found')
+    embeddings = pd.read_csv(path, index_col=0, header=None)
+    vectors = embeddings.to_numpy(dtype=np.float32)
+    with open(join(directory, TAGS), 'w') as stream:
+        json.dump(embeddings.index.tolist(), stream, ensure_ascii=False)
+    np.save(join(directory, EMBEDDINGS), vectors)
+    np.save(
+        join(directory, SIMILARITIES),
+        cosine_similarity(vectors).astype(np.float32))
+    return [TAGS, EMBEDDINGS, SIMILARITIES]
+
+
+def load_tables(directory: str) -> Optional[Tuple[List[str], np.ndarray]]:
+    """ Memory maps precomputed similarity table from the given directory.
+
+    Parameters
+    ----------
+    directory: str
+        Directory to load tables from.
+
+    Returns
+    -------
+    tables: Optional[Tuple[List[str], numpy.ndarray]]
+        Tag labels and read-only similarity matrix, `None` if not available.
+    """
+    path = join(directory, SIMILARITIES)
+    if not exists(path):
+        return None
+    with open(join(directory, TAGS), 'r') as stream:
+        tags = json.load(stream)
+    return tags, np.load(path, mmap_mode='r')
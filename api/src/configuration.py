@@ -5,6 +5,7 @@
 
 from os import environ
 from os.path import join
+from typing import List
 
 
 DATA: str = environ.get('DATA', '/opt/muzeeglot/data')
@@ -28,3 +29,60 @@ INGESTION_LOCK: str = join(INDEX, 'ingestion.lock')
 
 REDIS_HOST: str = environ.get('REDIS_HOST', 'redis')
 """ Hostname for Redis storage. """
+
+REDIS_REPLICA_HOST: str = environ.get('REDIS_REPLICA_HOST', REDIS_HOST)
+""" Hostname for Redis read replica, default to primary storage. """
+
+ARTIFACTS: str = environ.get('ARTIFACTS', '')
+""" Root directory of versioned artifact bundles, disabled if empty. """
+
+ARTIFACTS_VERSION: str = environ.get('ARTIFACTS_VERSION', 'latest')
+""" Artifact bundle version to publish or load. """
+
+REDIS_DATABASES: int = int(environ.get('REDIS_DATABASES', '16'))
+""" Number of Redis databases, each artifact bundle storing its data into its
+own database (database `0` being used if `ARTIFACTS` is empty). """
+
+METRICS_LOG_SAMPLING: float = float(environ.get('METRICS_LOG_SAMPLING', '0'))
+""" Ratio of requests (between 0 and 1) for which metrics are logged. """
+
+METRICS_DIRECTORY: str = environ.get('METRICS_DIRECTORY', '')
+""" Directory shared by workers to aggregate metrics, disabled if empty. """
+
+METRICS_FLUSH_INTERVAL: float = float(
+    environ.get('METRICS_FLUSH_INTERVAL', '1'))
+""" Delay in seconds between two flushes of worker metrics. """
+
+WARMUP: str = environ.get('WARMUP', 'blocking')
+""" Worker warm-up mode, either `blocking`, `background` or `none`. As
+workers share the listening socket, `blocking` ensures that only warm workers
+accept connections, whereas `/ready` only reflects the worker answering it in
+`background` mode. """
+
+WARMUP_TIMEOUT: int = int(environ.get('WARMUP_TIMEOUT', '120'))
+""" Gunicorn worker timeout in seconds, which blocking warm-up must fit in as
+workers only notify gunicorn once started. Mappers are only built during the
+first half of it, remaining ones being built on first request. """
+
+WARMUP_PAIRS: List[str] = environ.get('WARMUP_PAIRS', '').split()
+""" Mapper keys (formatted as `fr-es#en`) to build during warm-up. """
+
+WARMUP_POPULAR: int = int(environ.get('WARMUP_POPULAR', '5'))
+""" Number of most requested mappers to build during warm-up. """
+
+POPULARITY_KEY: str = 'mappers:popularity'
+""" Storage key of the mapper request counters. """
+
+POPULARITY_SAMPLING: float = float(environ.get('POPULARITY_SAMPLING', '0.1'))
+""" Ratio of `/predict` requests (between 0 and 1) counted in mapper
+popularity, which only needs to rank mappers. """
+
+NORMALIZATION_MEMO_SIZE: int = int(
+    environ.get('NORMALIZATION_MEMO_SIZE', '65536'))
+""" Maximum number of memoized tags missing from normalization cache. """
+
+STORAGE_LAYOUT: str = environ.get('STORAGE_LAYOUT', 'legacy')
+""" Redis data layout, either `legacy` or `compact`. """
+
+SIMILARITY_PROBES: int = int(environ.get('SIMILARITY_PROBES', '16'))
+""" Number of entity clusters scanned by similarity search. """
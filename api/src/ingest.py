@@ -5,9 +5,10 @@
 
 import ast
 
+from argparse import ArgumentParser
 from os import makedirs
 from os.path import exists, join
-from typing import Dict
+from typing import Dict, List
 from uuid import uuid4
 
 # pylint: disable=import-error
@@ -19,9 +20,12 @@ from whoosh.index import create_in
 from whoosh.writing import BufferedWriter
 # pylint: enable=import-error
 
-from . import configuration
-from .storage import storage
-from .types import Entity, Language, Tags
+from . import artifacts, configuration
+from .layout import LegacyLayout, get_layout
+from .normalization import Normalizer
+from .similarity import write as write_similarity
+from .storage import select, storage
+from .types import Entity, Tags
 
 
 def get_tags_corpus() -> Dict:
@@ -74,38 +78,48 @@ def get_entities_corpus() -> Dict:
     return entities
 
 
-def generate_eid() -> str:
+def generate_eid(layout: LegacyLayout, locales: List[str]) -> str:
     """ Generate and returns a unique identifier for entity. Based of uuid4
     generation and looped until uuid does not exists in storage.
 
+    Parameters
+    ----------
+    layout: LegacyLayout
+        Storage layout used to check identifier existence.
+    locales: List[str]
+        Supported locales.
+
     Returns
     -------
     eid: str
         Generated eid that not exists in storage.
     """
     eid = uuid4().hex
-    locales = Language.locales()
-    while any([
-            storage.get(f'{eid}:{locale}') is not None
-            for locale in locales]):
+    while layout.exists(eid, locales):
         eid = uuid4().hex
     return eid
 
 
-def ingest_languages(writer: BufferedWriter):
+def ingest_languages(writer: BufferedWriter) -> List[str]:
+    """ Ingests languages, and returns supported locales as read from primary
+    storage, as a read replica may not be up to date yet. """
     print('INFO: start languages ingestion')
     path = join(configuration.DATA, 'languages.csv')
     with open(path, 'r') as stream:
         languages = [line.strip() for line in stream.readlines()]
+        # NOTE: locales are rewritten so that ingesting again never
+        #       duplicates them.
+        storage.delete('locales')
         for i in range(len(languages)):
             locale, label = languages[i].split(',')
             print(f'\tingest [{locale}] language')
             writer.add_field(locale, BOOLEAN())
             storage.lpush('locales', locale)
             storage.set(f'locale:{locale}', label)
+    return [locale.decode() for locale in storage.lrange('locales', 0, -1)]
 
 
-def ingest_tags(corpus: Dict):
+def ingest_tags(corpus: Dict, layout: LegacyLayout):
     tags = {}
     print('INFO: flatten tags per locale')
     for veid in corpus.keys():
@@ -115,33 +129,45 @@ def ingest_tags(corpus: Dict):
             for tag in corpus[veid][locale]:
                 tags[locale].append(tag)
     print('INFO: start tags ingestion')
-    for locale in tags.keys():
-        print(f'\tingest [{locale}] tags')
-        key = f'tags:{locale}'
-        for tag in tags[locale]:
-            storage.sadd(key, tag)
+    layout.write_tags(tags)
+
+
+def ingest_normalization(corpus: Dict, directory: str):
+    print('INFO: build normalization cache')
+    Normalizer.dump(
+        join(directory, Normalizer.FILENAME),
+        (
+            tag
+            for locales in corpus.values()
+            for tags in locales.values()
+            for tag in tags))
 
 
-def ingest_entities(tags_corpus: Dict, writer: BufferedWriter):
+def ingest_entities(
+        tags_corpus: Dict,
+        writer: BufferedWriter,
+        layout: LegacyLayout,
+        supported: List[str]) -> List[Dict]:
     print('INFO: evaluate entities')
     entities_corpus = get_entities_corpus()
     print('INFO: start entities ingestion')
+    entities = []
     for veid in entities_corpus.keys():
         if veid not in tags_corpus:
             continue
-        tagsets = [
-                {'locale': locale, 'values': tags}
-                for locale, tags in tags_corpus[veid].items()]
-        eid = generate_eid()
+        tagsets = tags_corpus[veid]
+        eid = generate_eid(layout, supported)
         names = set()
-        for locale, uri in entities_corpus[veid].items():
+        for uri in entities_corpus[veid].values():
             names.add(Entity.name(uri))
-            storage.set(f'{eid}:{locale}', uri)
-        supported = Language.locales()
+        label = Entity.name(
+            entities_corpus[veid].get(
+                'en',
+                next(iter(entities_corpus[veid].values()))))
         locales = [
-            tags['locale']
-            for tags in tagsets
-            if tags['locale'] in supported and len(tags['values']) > 0]
+            locale
+            for locale, tags in tagsets.items()
+            if locale in supported and len(tags) > 0]
         onehot = {locale: locale in locales for locale in supported}
         for name in names:
             writer.add_document(
@@ -149,35 +175,83 @@ def ingest_entities(tags_corpus: Dict, writer: BufferedWriter):
                 name=name,
                 eid=eid,
                 **onehot)
-        for tags in tagsets:
-            locale = tags['locale']
-            key = f'{eid}:{locale}:tags'
-            for tag in tags['values']:
-                storage.lpush(key, tag)
+        layout.write_entity(eid, entities_corpus[veid], tagsets)
+        entities.append({
+            'eid': eid,
+            'label': label,
+            'tagsets': tagsets,
+            'onehot': onehot})
+    return entities
+
+
+def ingest(directory: str) -> List[str]:
+    """ Runs the whole ingestion, writing storage and artifacts.
+
+    Parameters
+    ----------
+    directory: str
+        Directory to write search index and artifacts into.
+
+    Returns
+    -------
+    files: List[str]
+        Names of written artifact files, besides search index.
+    """
+    print('INFO: evaluate tags corpus')
+    tags_corpus = get_tags_corpus()
+    print('INFO: create search index')
+    if not exists(directory):
+        makedirs(directory)
+    schema = Schema(ngram=NGRAMWORDS(), name=STORED(), eid=STORED())
+    index = create_in(directory, schema)
+    writer = BufferedWriter(index, period=60, limit=200)
+    layout = get_layout(storage)
+    locales = ingest_languages(writer)
+    ingest_tags(tags_corpus, layout)
+    ingest_normalization(tags_corpus, directory)
+    print('INFO: write mapping tables')
+    files = artifacts.write_tables(directory)
+    entities = ingest_entities(tags_corpus, writer, layout, locales)
+    print('INFO: optimize and close index')
+    writer.close()
+    index.optimize()
+    index.close()
+    print('INFO: write entity similarity index')
+    files += write_similarity(directory, entities, locales)
+    return [Normalizer.FILENAME] + files
 
 
 if __name__ == '__main__':
+    parser = ArgumentParser(description='Muzeeglot data ingestion')
+    parser.add_argument(
+        '--republish',
+        action='store_true',
+        help='publish a new bundle even if one was already published')
+    args = parser.parse_args()
     print('-' * 30)
     print('Muzeeglot data ingestion')
     print('-' * 30)
-    if exists(configuration.INGESTION_LOCK):
+    if configuration.ARTIFACTS:
+        version = artifacts.version()
+        if (
+                (
+                    configuration.ARTIFACTS_VERSION == 'latest'
+                    and artifacts.latest() is not None
+                    and not args.republish)
+                or exists(join(configuration.ARTIFACTS, version))):
+            print('WARN: artifact bundle already published, pass')
+        else:
+            db = artifacts.allocate()
+            print(f'INFO: ingest storage into database {db}')
+            select(db)
+            directory = artifacts.staging(version)
+            files = ingest(directory)
+            print(f'INFO: publish artifact bundle {version}')
+            artifacts.publish(directory, version, files, db)
+    elif exists(configuration.INGESTION_LOCK):
         print('WARN: ingestion lock detected, pass')
     else:
-        print('INFO: evaluate tags corpus')
-        tags_corpus = get_tags_corpus()
-        print('INFO: create search index')
-        if not exists(configuration.INDEX):
-            makedirs(configuration.INDEX)
-        schema = Schema(ngram=NGRAMWORDS(), name=STORED(), eid=STORED())
-        index = create_in(configuration.INDEX, schema)
-        writer = BufferedWriter(index, period=60, limit=200)
-        ingest_languages(writer)
-        ingest_tags(tags_corpus)
-        ingest_entities(tags_corpus, writer)
-        print('INFO: optimize and close index')
-        writer.close()
-        index.optimize()
-        index.close()
+        ingest(configuration.INDEX)
         print('INFO: write ingestion lock')
         with open(configuration.INGESTION_LOCK, 'w') as stream:
             stream.write('ingested')
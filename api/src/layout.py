@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Storage layouts used to persist tags and entities into Redis.
+
+Two layouts are supported:
+
+- `legacy`: one string key per `{eid}:{locale}` URI, one list per
+  `{eid}:{locale}:tags` with full tag names, and one set per `tags:{locale}`.
+- `compact`: a single `tags:dictionary` list mapping integer identifiers to
+  tag names, and one `entity:{eid}` hash per entity holding `{locale}` URI
+  fields and `{locale}:tags` fields as packed tag identifier arrays. Tags of a
+  locale are derived from the dictionary as tag names are locale prefixed.
+"""
+
+import struct
+
+from typing import Dict, List
+
+from redis import Redis
+
+from . import configuration
+
+DICTIONARY_KEY = 'tags:dictionary'
+""" Storage key of the compact tag dictionary. """
+
+WRITE_CHUNK = 1000
+""" Maximum number of values sent per write command. """
+
+
+def pack(ids: List[int]) -> bytes:
+    """ Packs the given tag identifiers as little endian uint32 array.
+
+    Parameters
+    ----------
+    ids: List[int]
+        Tag identifiers to pack.
+
+    Returns
+    -------
+    packed: bytes
+        Packed identifiers.
+    """
+    return struct.pack(f'<{len(ids)}I', *ids)
+
+
+def unpack(packed: bytes) -> List[int]:
+    """ Unpacks tag identifiers packed with `pack(ids)`.
+
+    Parameters
+    ----------
+    packed: bytes
+        Packed identifiers.
+
+    Returns
+    -------
+    ids: List[int]
+        Unpacked tag identifiers.
+    """
+    return list(struct.unpack(f'<{len(packed) // 4}I', packed))
+
+
+class LegacyLayout(object):
+    """ Legacy layout writer. """
+
+    def __init__(self, client: Redis):
+        """ Default constructor.
+
+        Parameters
+        ----------
+        client: Redis
+            Storage client to write to.
+        """
+        self._client = client
+
+    def exists(self, eid: str, locales: List[str]) -> bool:
+        """ Indicates if the given entity identifier is already used.
+
+        Parameters
+        ----------
+        eid: str
+            Entity identifier to check.
+        locales: List[str]
+            Supported locales.
+
+        Returns
+        -------
+        exists: bool
+            `True` if identifier is already used, `False` otherwise.
+        """
+        return any([
+            self._client.get(f'{eid}:{locale}') is not None
+            for locale in locales])
+
+    def write_tags(self, tags: Dict[str, List[str]]) -> None:
+        """ Writes tags per locale.
+
+        Parameters
+        ----------
+        tags: Dict[str, List[str]]
+            Tags indexed by locale.
+        """
+        for locale, values in tags.items():
+            for i in range(0, len(values), WRITE_CHUNK):
+                self._client.sadd(
+                    f'tags:{locale}',
+                    *values[i:i + WRITE_CHUNK])
+
+    def write_entity(
+            self,
+            eid: str,
+            uris: Dict[str, str],
+            tagsets: Dict[str, List[str]]) -> None:
+        """ Writes an entity URIs and tags.
+
+        Parameters
+        ----------
+        eid: str
+            Entity identifier.
+        uris: Dict[str, str]
+            Entity URI indexed by locale.
+        tagsets: Dict[str, List[str]]
+            Entity tags indexed by locale.
+        """
+        pipeline = self._client.pipeline(transaction=False)
+        for locale, uri in uris.items():
+            pipeline.set(f'{eid}:{locale}', uri)
+        for locale, tags in tagsets.items():
+            if len(tags) > 0:
+                pipeline.lpush(f'{eid}:{locale}:tags', *tags)
+        pipeline.execute()
+
+
+class CompactLayout(LegacyLayout):
+    """ Compact layout writer. """
+
+    def __init__(self, client: Redis):
+        """ Default constructor.
+
+        Parameters
+        ----------
+        client: Redis
+            Storage client to write to.
+        """
+        super().__init__(client)
+        self._ids: Dict[str, int] = None
+
+    def exists(self, eid: str, locales: List[str]) -> bool:
+        """ See `LegacyLayout.exists(eid, locales)`. """
+        return self._client.exists(f'entity:{eid}') > 0
+
+    def write_tags(self, tags: Dict[str, List[str]]) -> None:
+        """ Appends tags missing from dictionary, see
+        `LegacyLayout.write_tags(tags)`. Existing identifiers are never
+        changed, so that entities already written remain decodable. """
+        if self._ids is None:
+            self._ids = {
+                name.decode(): i
+                for i, name in enumerate(
+                    self._client.lrange(DICTIONARY_KEY, 0, -1))}
+        names = sorted({
+            tag
+            for values in tags.values()
+            for tag in values
+            if tag not in self._ids})
+        for i in range(0, len(names), WRITE_CHUNK):
+            chunk = names[i:i + WRITE_CHUNK]
+            length = self._client.rpush(DICTIONARY_KEY, *chunk)
+            for j, name in enumerate(chunk, length - len(chunk)):
+                self._ids[name] = j
+
+    def write_entity(
+            self,
+            eid: str,
+            uris: Dict[str, str],
+            tagsets: Dict[str, List[str]]) -> None:
+        """ See `LegacyLayout.write_entity(eid, uris, tagsets)`. Tags are
+        stored in reversed order to match legacy list ordering. """
+        mapping = dict(uris)
+        for locale, tags in tagsets.items():
+            if len(tags) > 0:
+                mapping[f'{locale}:tags'] = pack([
+                    self._ids[tag]
+                    for tag in reversed(tags)])
+        if len(mapping) > 0:
+            self._client.hset(f'entity:{eid}', mapping=mapping)
+
+
+LAYOUTS: Dict[str, type] = {
+    'legacy': LegacyLayout,
+    'compact': CompactLayout}
+""" Available layout writers indexed by name. """
+
+
+def get_layout(client: Redis) -> LegacyLayout:
+    """ Creates the layout writer configured through `STORAGE_LAYOUT`.
+
+    Parameters
+    ----------
+    client: Redis
+        Storage client to write to.
+
+    Returns
+    -------
+    layout: LegacyLayout
+        Configured layout writer.
+    """
+    if configuration.STORAGE_LAYOUT not in LAYOUTS:
+        raise ValueError(
+            f'Unsupported storage layout {configuration.STORAGE_LAYOUT}')
+    return LAYOUTS[configuration.STORAGE_LAYOUT](client)
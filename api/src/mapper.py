@@ -6,60 +6,18 @@
 import re
 
 from os.path import exists
-from typing import Callable, Dict, List
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
 
-import MeCab
+import numpy as np
 import pandas as pd
 
+from scipy.sparse import csr_matrix
 from sklearn.metrics.pairwise import cosine_similarity
 
-from . import configuration
-
-SPACE_CHARSET = '_-/,・'
-""" Set of chars that aims to be replaced by blank space. """
-
-REMOVE_CHARSET = "():.!$'‘’"
-""" Set of chars that aims to be removed. """
-
-wakati = MeCab.Tagger('-Owakati')
-""" Japanese parser. """
-
-
-def normalize(tag: str) -> str:
-    """ Normalize the given tag by removing special chars and / or replacing
-    them by blank spaces. Assume that the given tag as the following prefixed
-    structure : `lang:tag`.
-
-    If the target lang is `ja` then it will performs an additional
-    normalization based on `MeCab wakiti` parser.
-
-    Parameters
-    ----------
-    tag: str
-        Tag to be normalized.
-
-    Returns
-    -------
-    normalized: str
-        Normalized tag.
-
-    Notes
-    -----
-    No value check is performed for error handling. Thus invalid tag will lead
-    to IndexError exception.
-    """
-    lang = tag[:2]
-    tag = tag[3:].lower()
-    normalized = []
-    for c in tag:
-        if c in SPACE_CHARSET:
-            normalized.append(' ')
-        elif c not in REMOVE_CHARSET:
-            normalized.append(c)
-    normalized = ''.join(normalized)
-    if lang == 'ja':
-        normalized = wakati.parse(normalized).replace('\n', '').rstrip()
-    return f'{lang}:{normalized}'
+from . import artifacts, configuration
+from .metrics import Metrics
+from .normalization import normalize
 
 
 def get_genre_name(entity: str) -> str:
@@ -90,12 +48,18 @@ class GenreMapper(object):
     instances: Dict = {}
     """ Mapper instances indexed by source and target languages. """
 
+    lock: Lock = Lock()
+    """ Lock preventing concurrent embeddings loading (i.e. warm-up). """
+
     mappings: pd.DataFrame = None
     """ Taxonomie mapping table loaded from embeddings. """
 
     tag_per_lang_graph: Dict = {}
     """ Tagset indexed by language. """
 
+    directory: Optional[str] = None
+    """ Artifact directory to load precomputed mapping tables from if any. """
+
     def __init__(
             self,
             sources: List[str],
@@ -113,7 +77,9 @@ class GenreMapper(object):
         """
         self._sources = sources
         self._target = target
-        self._mappings = self.get_mappings(sources, target, tag_provider)
+        with Metrics.span('mapper.build'):
+            self._mappings = self.get_mappings(sources, target, tag_provider)
+        self._rows = {tag: i for i, tag in enumerate(self._mappings.index)}
 
     def predict(
             self,
@@ -133,27 +99,93 @@ class GenreMapper(object):
         predictions: List[str]
             List of filtered prediction tags.
         """
-        predictions = (
-            self._mappings
-                .loc[tags]
-                .mean(axis=0)
-                .sort_values(ascending=False)
-                .index
-                .tolist())
-        return [tag for tag in predictions if tfilter(tag)]
+        with Metrics.span('mapper.aggregate'):
+            predictions = (
+                self._mappings
+                    .loc[tags]
+                    .mean(axis=0)
+                    .sort_values(ascending=False)
+                    .index
+                    .tolist())
+        with Metrics.span('mapper.filter'):
+            return [tag for tag in predictions if tfilter(tag)]
+
+    def predict_batch(
+            self,
+            batch: List[List[str]],
+            k: int) -> List[List[str]]:
+        """ Vectorized version of `predict(tags, tfilter)` for a batch of
+        tagsets, which averages mapping rows through a single sparse matrix
+        product. Unknown tags are ignored, and no filtering is applied as
+        mapping columns are already the target tags.
+
+        Parameters
+        ----------
+        batch: List[List[str]]
+            Tagsets to predict translation for.
+        k: int
+            Maximum number of predictions per tagset.
+
+        Returns
+        -------
+        predictions: List[List[str]]
+            Top `k` prediction tags for each tagset.
+        """
+        data, indices, indptr = [], [], [0]
+        for tags in batch:
+            known = [self._rows[tag] for tag in tags if tag in self._rows]
+            indices.extend(known)
+            data.extend([1. / max(len(known), 1)] * len(known))
+            indptr.append(len(indices))
+        weights = csr_matrix(
+            (data, indices, indptr),
+            shape=(len(batch), len(self._rows)))
+        scores = weights @ self._mappings.to_numpy()
+        k = min(k, scores.shape[1])
+        if k == 0:
+            return [[] for _ in batch]
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        columns = self._mappings.columns
+        return [
+            [columns[j] for j in top[i]] if indptr[i + 1] > indptr[i] else []
+            for i in range(len(batch))]
 
     @classmethod
     def load_embeddings(cls: type) -> None:
-        """ Class factory method that load embeddings data. """
+        """ Class factory method that load embeddings data. Precomputed
+        mapping tables are memory mapped from artifact directory if available,
+        otherwise they are computed from embeddings CSV file. """
+        if cls.directory is not None:
+            with Metrics.span('mapper.tables'):
+                tables = artifacts.load_tables(cls.directory)
+            if tables is not None:
+                tags, similarities = tables
+                cls.mappings = pd.DataFrame(
+                    similarities,
+                    index=tags,
+                    columns=tags,
+                    copy=False)
+                return
         path = configuration.EMBEDDINGS
         if not exists(path):
             raise IOError(f'Embeddings file {path} not found')
-        embeddings = pd.read_csv(path, index_col=0, header=None)
-        similarities = cosine_similarity(embeddings.to_numpy())
-        cls.mappings = pd.DataFrame(
-            similarities,
-            index=embeddings.index,
-            columns=embeddings.index)
+        with Metrics.span('mapper.embeddings'):
+            embeddings = pd.read_csv(path, index_col=0, header=None)
+            similarities = cosine_similarity(embeddings.to_numpy())
+            cls.mappings = pd.DataFrame(
+                similarities,
+                index=embeddings.index,
+                columns=embeddings.index)
+
+    @classmethod
+    def ensure_embeddings(cls: type) -> None:
+        """ Loads embeddings data if not already loaded. Safe to be called
+        concurrently from warm-up thread and request handlers. """
+        with cls.lock:
+            if cls.mappings is None:
+                cls.load_embeddings()
 
     @classmethod
     def get_mappings(
@@ -175,8 +207,7 @@ class GenreMapper(object):
         mappings: pandas.DataFrame
             Built mapping table as pandas.DataFrame
         """
-        if cls.mappings is None:
-            cls.load_embeddings()
+        cls.ensure_embeddings()
         sources_tags = [
             tag
             for source in sources
@@ -190,6 +221,49 @@ class GenreMapper(object):
             index=sources_tags,
             columns=target_tags)
 
+    @staticmethod
+    def key(sources: List[str], target: str) -> str:
+        """ Builds the instance key for a given (sources, target) pair.
+
+        Parameters
+        ----------
+        sources: List[str]
+            List of source languages to map genre from.
+        target: str
+            Target language to map genre to.
+
+        Returns
+        -------
+        key: str
+            Instance key formatted as `source1-source2#target`.
+        """
+        return '{}#{}'.format('-'.join(sources), target)
+
+    @staticmethod
+    def parse_key(key: str) -> Tuple[List[str], str]:
+        """ Parses an instance key built with `key(sources, target)`.
+
+        Parameters
+        ----------
+        key: str
+            Instance key to parse.
+
+        Returns
+        -------
+        pair: Tuple[List[str], str]
+            Parsed (sources, target) pair.
+
+        Raises
+        ------
+        ValueError
+            If the given key is malformed.
+        """
+        sources, target = key.split('#')
+        sources = sources.split('-')
+        if len(target) == 0 or any([len(s) == 0 for s in sources]):
+            raise ValueError(f'Invalid mapper key {key}')
+        return sources, target
+
     @classmethod
     def get(
             cls: type,
@@ -216,7 +290,11 @@ class GenreMapper(object):
         if not isinstance(target, str):
             raise ValueError()
         # TODO: check language support.
-        key = '{}#{}'.format('-'.join(sources), target)
+        key = cls.key(sources, target)
         if key not in cls.instances:
+            Metrics.increment('mapper_cache', 'result', 'miss')
             cls.instances[key] = cls(sources, target, tag_provider)
+            Metrics.gauge('mapper_instances', len(cls.instances))
+        else:
+            Metrics.increment('mapper_cache', 'result', 'hit')
         return cls.instances[key]
@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Lightweight in-process instrumentation exposed in Prometheus format.
+
+As gunicorn workers share a single socket, any worker may answer a scrape.
+When a shared directory is configured, each worker periodically dumps its
+registry into its own snapshot file, and `/metrics` renders the merge of every
+snapshot, including those of workers which exited, so that counters and
+histograms never go backwards. Gauges are labelled by worker `pid` and only
+rendered for live workers.
+"""
+
+import json
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from glob import glob
+from os import getpid, kill, makedirs, replace
+from os.path import join
+from threading import Lock, Thread
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+SECONDS_BUCKETS: Tuple[float, ...] = (
+    .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+""" Histogram buckets (in seconds) used for timing spans. """
+
+COMMANDS_BUCKETS: Tuple[float, ...] = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+""" Histogram buckets used for per request Redis command count. """
+
+PREFIX = 'muzeeglot'
+""" Prefix of every exposed metric name. """
+
+request_context: ContextVar = ContextVar('request_context', default=None)
+""" Per request metrics (spans and Redis commands) if any. """
+
+
+class Histogram(object):
+    """ Cumulative histogram with fixed upper bounds. """
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        """ Default constructor.
+
+        Parameters
+        ----------
+        buckets: Tuple[float, ...]
+            Sorted bucket upper bounds, `+Inf` bucket is implicit.
+        """
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value: float) -> None:
+        """ Record the given value.
+
+        Parameters
+        ----------
+        value: float
+            Value to record.
+        """
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def dump(self) -> Dict[str, Any]:
+        """ Returns this histogram state as a JSON serializable dict.
+
+        Returns
+        -------
+        state: Dict[str, Any]
+            Histogram bucket counts, total count and sum.
+        """
+        return {'counts': self.counts, 'count': self.count, 'sum': self.sum}
+
+    def add(self, state: Dict[str, Any]) -> None:
+        """ Adds the given histogram state, as returned by `dump()`, to this
+        histogram.
+
+        Parameters
+        ----------
+        state: Dict[str, Any]
+            Histogram state to add.
+        """
+        for i, count in enumerate(state['counts']):
+            self.counts[i] += count
+        self.count += state['count']
+        self.sum += state['sum']
+
+    def render(self, name: str, labels: str) -> List[str]:
+        """ Renders this histogram as Prometheus text lines.
+
+        Parameters
+        ----------
+        name: str
+            Metric name.
+        labels: str
+            Formatted label pairs (without braces).
+
+        Returns
+        -------
+        lines: List[str]
+            Prometheus sample lines.
+        """
+        lines = [
+            f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+            for bound, count in zip(self.buckets, self.counts)]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+def alive(pid: int) -> bool:
+    """ Indicates if the given process is running.
+
+    Parameters
+    ----------
+    pid: int
+        Identifier of the process to check.
+
+    Returns
+    -------
+    alive: bool
+        `True` if the process is running, `False` otherwise.
+    """
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metrics(object):
+    """ Process wide metric registry, merged with other worker registries
+    through snapshot files if `share(directory, interval)` was called. """
+
+    lock: Lock = Lock()
+    """ Lock guarding registry updates from threadpool workers. """
+
+    directory: Optional[str] = None
+    """ Directory shared by workers to write snapshots into, if any. """
+
+    snapshot: Optional[str] = None
+    """ Path of this worker snapshot file. """
+
+    spans: Dict[str, Histogram] = {}
+    """ Span duration histograms indexed by span name. """
+
+    requests: Dict[str, Histogram] = {}
+    """ Request duration histograms indexed by endpoint name. """
+
+    commands: Dict[str, Histogram] = {}
+    """ Per request Redis command count histograms indexed by endpoint. """
+
+    counters: Dict[Tuple[str, str, str], float] = {}
+    """ Counters indexed by (metric, label name, label value). """
+
+    gauges: Dict[str, float] = {}
+    """ Gauges indexed by metric name. """
+
+    @classmethod
+    def observe(cls: type, name: str, seconds: float) -> None:
+        """ Record a span duration globally and for the current request.
+
+        Parameters
+        ----------
+        name: str
+            Name of the span.
+        seconds: float
+            Span duration in seconds.
+        """
+        with cls.lock:
+            if name not in cls.spans:
+                cls.spans[name] = Histogram(SECONDS_BUCKETS)
+            cls.spans[name].observe(seconds)
+        context = request_context.get()
+        if context is not None:
+            spans = context['spans']
+            spans[name] = spans.get(name, 0.) + seconds
+
+    @classmethod
+    @contextmanager
+    def span(cls: type, name: str) -> Iterator[None]:
+        """ Context manager that times the enclosed block.
+
+        Parameters
+        ----------
+        name: str
+            Name of the span.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.observe(name, time.perf_counter() - start)
+
+    @classmethod
+    def increment(
+            cls: type,
+            name: str,
+            label: str,
+            value: str,
+            amount: float = 1) -> None:
+        """ Increments a labelled counter.
+
+        Parameters
+        ----------
+        name: str
+            Counter name (without prefix and `_total` suffix).
+        label: str
+            Label name.
+        value: str
+            Label value.
+        amount: float
+            Increment value.
+        """
+        key = (name, label, value)
+        with cls.lock:
+            cls.counters[key] = cls.counters.get(key, 0) + amount
+
+    @classmethod
+    def gauge(cls: type, name: str, value: float) -> None:
+        """ Set a gauge value.
+
+        Parameters
+        ----------
+        name: str
+            Gauge name (without prefix).
+        value: float
+            Gauge value.
+        """
+        with cls.lock:
+            cls.gauges[name] = value
+
+    @classmethod
+    def command(cls: type, command: str) -> None:
+        """ Record a Redis command globally and for the current request.
+
+        Parameters
+        ----------
+        command: str
+            Redis command name.
+        """
+        cls.increment('redis_commands', 'command', command)
+        context = request_context.get()
+        if context is not None:
+            context['commands'] += 1
+
+    @staticmethod
+    def begin() -> Dict:
+        """ Starts a per request metric context.
+
+        Returns
+        -------
+        context: Dict
+            Request context which will be filled by spans and commands.
+        """
+        context = {'spans': {}, 'commands': 0}
+        request_context.set(context)
+        return context
+
+    @classmethod
+    def end(cls: type, endpoint: str, context: Dict, seconds: float) -> None:
+        """ Closes a per request metric context.
+
+        Parameters
+        ----------
+        endpoint: str
+            Name of the served endpoint.
+        context: Dict
+            Request context as returned by `begin()`.
+        seconds: float
+            Request duration in seconds.
+        """
+        with cls.lock:
+            if endpoint not in cls.requests:
+                cls.requests[endpoint] = Histogram(SECONDS_BUCKETS)
+                cls.commands[endpoint] = Histogram(COMMANDS_BUCKETS)
+            cls.requests[endpoint].observe(seconds)
+            cls.commands[endpoint].observe(context['commands'])
+
+    @classmethod
+    def dump(cls: type) -> Dict[str, Any]:
+        """ Returns the registry state as a JSON serializable dict.
+
+        Returns
+        -------
+        state: Dict[str, Any]
+            Registry state.
+        """
+        with cls.lock:
+            return {
+                'pid': getpid(),
+                'spans': {
+                    name: histogram.dump()
+                    for name, histogram in cls.spans.items()},
+                'requests': {
+                    name: histogram.dump()
+                    for name, histogram in cls.requests.items()},
+                'commands': {
+                    name: histogram.dump()
+                    for name, histogram in cls.commands.items()},
+                'counters': [
+                    [*key, value]
+                    for key, value in cls.counters.items()],
+                'gauges': dict(cls.gauges)}
+
+    @classmethod
+    def flush(cls: type) -> None:
+        """ Atomically writes the registry state into this worker snapshot
+        file, if a shared directory is configured. """
+        if cls.directory is None:
+            return
+        state = json.dumps(cls.dump())
+        with open(f'{cls.snapshot}.tmp', 'w') as stream:
+            stream.write(state)
+        replace(f'{cls.snapshot}.tmp', cls.snapshot)
+
+    @classmethod
+    def share(cls: type, directory: str, interval: float) -> None:
+        """ Shares this worker registry with other workers through the given
+        directory, flushing it periodically from a background thread.
+
+        Parameters
+        ----------
+        directory: str
+            Directory shared by workers.
+        interval: float
+            Delay between two flushes in seconds.
+        """
+        makedirs(directory, exist_ok=True)
+        # NOTE: a random suffix avoids overwriting the snapshot of an exited
+        #       worker if its pid is reused.
+        cls.snapshot = join(directory, f'{getpid()}-{uuid4().hex[:8]}.json')
+        cls.directory = directory
+        cls.flush()
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                cls.flush()
+        Thread(target=loop, daemon=True).start()
+
+    @classmethod
+    def collect(cls: type) -> List[Dict[str, Any]]:
+        """ Collects registry states of every worker.
+
+        Returns
+        -------
+        states: List[Dict[str, Any]]
+            Registry states, only this worker one if no directory is shared.
+        """
+        if cls.directory is None:
+            return [cls.dump()]
+        cls.flush()
+        states = []
+        for path in glob(join(cls.directory, '*.json')):
+            with open(path, 'r') as stream:
+                states.append(json.load(stream))
+        return states
+
+    @classmethod
+    def render(cls: type) -> str:
+        """ Renders the registry, merged with other worker registries if
+        shared, using Prometheus text exposition format.
+
+        Returns
+        -------
+        payload: str
+            Prometheus text payload.
+        """
+        histograms = (
+            ('span_seconds', 'span', 'spans', SECONDS_BUCKETS),
+            ('request_seconds', 'endpoint', 'requests', SECONDS_BUCKETS),
+            ('request_redis_commands', 'endpoint', 'commands',
+                COMMANDS_BUCKETS))
+        merged = {kind: {} for _, _, kind, _ in histograms}
+        counters = {}
+        gauges = {}
+        for state in cls.collect():
+            for _, _, kind, buckets in histograms:
+                for value, histogram in state[kind].items():
+                    if value not in merged[kind]:
+                        merged[kind][value] = Histogram(buckets)
+                    merged[kind][value].add(histogram)
+            for name, label, value, amount in state['counters']:
+                key = (name, label, value)
+                counters[key] = counters.get(key, 0) + amount
+            if state['pid'] == getpid() or alive(state['pid']):
+                for name, value in state['gauges'].items():
+                    gauges.setdefault(name, []).append((state['pid'], value))
+        lines = []
+        for name, label, kind, _ in histograms:
+            name = f'{PREFIX}_{name}'
+            lines.append(f'# TYPE {name} histogram')
+            for value, series in sorted(merged[kind].items()):
+                lines.extend(series.render(name, f'{label}="{value}"'))
+        names = sorted({key[0] for key in counters})
+        for name in names:
+            lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+            for key, value in sorted(counters.items()):
+                if key[0] == name:
+                    lines.append(
+                        f'{PREFIX}_{name}_total'
+                        f'{{{key[1]}="{key[2]}"}} {value}')
+        for name, values in sorted(gauges.items()):
+            lines.append(f'# TYPE {PREFIX}_{name} gauge')
+            for pid, value in sorted(values):
+                lines.append(f'{PREFIX}_{name}{{pid="{pid}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def summary(context: Optional[Dict]) -> str:
+        """ Formats a request context as a single log friendly line.
+
+        Parameters
+        ----------
+        context: Optional[Dict]
+            Request context as returned by `begin()`.
+
+        Returns
+        -------
+        summary: str
+            Formatted summary.
+        """
+        if context is None:
+            return ''
+        spans = ' '.join(
+            f'{name}={seconds * 1000:.2f}ms'
+            for name, seconds in sorted(context['spans'].items()))
+        return f'redis={context["commands"]} {spans}'.rstrip()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Storage layout migration script.
+
+Migrates an ingested `legacy` storage into `compact` layout:
+
+    python -m muzeeglot.migrate [--keep]
+
+When `ARTIFACTS` is set, the database of the configured bundle is migrated and
+its manifest layout updated accordingly.
+
+Or compares memory footprint of both layouts using a synthetic corpus written
+into a scratch Redis database (which will be flushed):
+
+    python -m muzeeglot.migrate --compare [--entities N] [--db 15]
+"""
+
+import random
+import re
+
+from argparse import ArgumentParser
+from typing import Dict, List, Tuple
+
+from redis import Redis
+
+from . import artifacts, configuration
+from .layout import DICTIONARY_KEY, CompactLayout, LegacyLayout
+from .storage import storage
+from .types import Language
+
+LEGACY_KEY = re.compile(r'([0-9a-f]{32}):([a-z]{2})(:tags)?\Z')
+""" Pattern matching legacy entity keys. """
+
+
+def migrate(keep: bool) -> None:
+    """ Migrates legacy layout into compact layout. Migration is idempotent:
+    it passes if no legacy key remains, and tag dictionary is only appended
+    so that already migrated entities remain decodable.
+
+    Parameters
+    ----------
+    keep: bool
+        If `True` legacy keys are not deleted.
+    """
+    locales = Language.locales()
+    print('INFO: collect legacy entities')
+    entities = set()
+    for key in storage.scan_iter(count=1000):
+        match = LEGACY_KEY.match(key.decode())
+        if match is not None:
+            entities.add(match.group(1))
+    sets = [
+        f'tags:{locale}'
+        for locale in locales
+        if storage.exists(f'tags:{locale}')]
+    if len(entities) == 0 and len(sets) == 0:
+        if storage.exists(DICTIONARY_KEY):
+            print('WARN: storage already migrated, pass')
+        else:
+            print('WARN: no legacy data found, pass')
+        return
+    print('INFO: migrate tags dictionary')
+    layout = CompactLayout(storage)
+    layout.write_tags({
+        locale: [tag.decode() for tag in storage.smembers(f'tags:{locale}')]
+        for locale in locales})
+    print(f'INFO: migrate {len(entities)} entities')
+    for eid in entities:
+        uris = {}
+        tagsets = {}
+        legacy = []
+        for locale in locales:
+            uri = storage.get(f'{eid}:{locale}')
+            if uri is not None:
+                uris[locale] = uri.decode()
+                legacy.append(f'{eid}:{locale}')
+            tags = storage.lrange(f'{eid}:{locale}:tags', 0, -1)
+            if len(tags) > 0:
+                # NOTE: lists were built using LPUSH thus reversed.
+                tagsets[locale] = [tag.decode() for tag in reversed(tags)]
+                legacy.append(f'{eid}:{locale}:tags')
+        # NOTE: ensure tags missing from locale sets are known.
+        layout.write_tags(tagsets)
+        layout.write_entity(eid, uris, tagsets)
+        if not keep and len(legacy) > 0:
+            storage.delete(*legacy)
+    if not keep and len(sets) > 0:
+        storage.delete(*sets)
+    print('INFO: migration done, set STORAGE_LAYOUT=compact')
+
+
+def synthetic_corpus(
+        entities: int,
+        locales: List[str],
+        vocabulary: int,
+        tags: int) -> Tuple[Dict, Dict]:
+    """ Generates a synthetic corpus.
+
+    Parameters
+    ----------
+    entities: int
+        Number of entities to generate.
+    locales: List[str]
+        Locales to generate entities for.
+    vocabulary: int
+        Number of distinct tags per locale.
+    tags: int
+        Maximum number of tags per (entity, locale) pair.
+
+    Returns
+    -------
+    corpus: Tuple[Dict, Dict]
+        Tags indexed by locale, and entities as (URIs, tagsets) indexed by
+        identifier.
+    """
+    rng = random.Random(42)
+    vocabularies = {
+        locale: [
+            f'{locale}:Synthetic_music_genre_{i}'
+            for i in range(vocabulary)]
+        for locale in locales}
+    corpus = {}
+    for i in range(entities):
+        eid = f'{rng.getrandbits(128):032x}'
+        available = rng.sample(locales, rng.randint(1, len(locales)))
+        uris = {
+            locale: f'http://{locale}.dbpedia.org/resource/Artist_{i}'
+            for locale in available}
+        tagsets = {
+            locale: rng.sample(vocabularies[locale], rng.randint(1, tags))
+            for locale in available}
+        corpus[eid] = (uris, tagsets)
+    return vocabularies, corpus
+
+
+def footprint(client: Redis, layout: LegacyLayout, corpus: Tuple) -> Tuple:
+    """ Writes the given corpus using the given layout and measures footprint.
+
+    Parameters
+    ----------
+    client: Redis
+        Scratch storage client, flushed before and after measure.
+    layout: LegacyLayout
+        Layout writer to evaluate.
+    corpus: Tuple
+        Synthetic corpus as generated by `synthetic_corpus`.
+
+    Returns
+    -------
+    footprint: Tuple[int, int]
+        Used memory in bytes and number of keys.
+    """
+    vocabularies, entities = corpus
+    client.flushdb()
+    before = client.info('memory')['used_memory']
+    layout.write_tags(vocabularies)
+    for eid, (uris, tagsets) in entities.items():
+        layout.write_entity(eid, uris, tagsets)
+    used = client.info('memory')['used_memory'] - before
+    keys = client.dbsize()
+    client.flushdb()
+    return used, keys
+
+
+def compare(entities: int, db: int, vocabulary: int, tags: int) -> None:
+    """ Compares legacy and compact layouts footprint on a synthetic corpus.
+
+    Parameters
+    ----------
+    entities: int
+        Number of synthetic entities.
+    db: int
+        Scratch database index.
+    vocabulary: int
+        Number of distinct tags per locale.
+    tags: int
+        Maximum number of tags per (entity, locale) pair.
+    """
+    if db == storage.connection_pool.connection_kwargs.get('db', 0):
+        raise ValueError('Scratch database must differ from API storage')
+    client = Redis(host=configuration.REDIS_HOST, db=db)
+    if client.dbsize() > 0:
+        raise ValueError(f'Scratch database {db} is not empty')
+    locales = ['fr', 'es', 'en', 'nl', 'cs', 'ja']
+    print(f'INFO: generate {entities} synthetic entities')
+    corpus = synthetic_corpus(entities, locales, vocabulary, tags)
+    results = {
+        'legacy': footprint(client, LegacyLayout(client), corpus),
+        'compact': footprint(client, CompactLayout(client), corpus)}
+    print(f'{"layout":<10}{"memory (MB)":>14}{"keys":>12}')
+    for name, (used, keys) in results.items():
+        print(f'{name:<10}{used / 1024 ** 2:>14.2f}{keys:>12}')
+    ratio = results['compact'][0] / max(results['legacy'][0], 1)
+    print(f'compact layout uses {ratio:.1%} of legacy memory')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Muzeeglot storage layout migration')
+    parser.add_argument(
+        '--keep',
+        action='store_true',
+        help='keep legacy keys after migration')
+    parser.add_argument(
+        '--compare',
+        action='store_true',
+        help='compare layouts footprint on a synthetic corpus instead')
+    parser.add_argument('--entities', type=int, default=100000)
+    parser.add_argument('--vocabulary', type=int, default=2000)
+    parser.add_argument('--tags', type=int, default=8)
+    parser.add_argument('--db', type=int, default=15)
+    args = parser.parse_args()
+    if args.compare:
+        compare(args.entities, args.db, args.vocabulary, args.tags)
+    else:
+        directory = artifacts.locate()
+        artifacts.attach(directory)
+        migrate(args.keep)
+        if configuration.ARTIFACTS:
+            manifest = artifacts.read_manifest(directory)
+            manifest['layout'] = 'compact'
+            artifacts.write_manifest(directory, manifest)
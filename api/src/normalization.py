@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Tag normalization service backed by a persistent cache. """
+
+import json
+
+from functools import lru_cache
+from os.path import exists
+from typing import Dict, Iterable
+
+import MeCab
+
+from . import configuration
+from .metrics import Metrics
+
+SPACE_CHARSET = '_-/,・'
+""" Set of chars that aims to be replaced by blank space. """
+
+REMOVE_CHARSET = "():.!$'‘’"
+""" Set of chars that aims to be removed. """
+
+TRANSLATION = str.maketrans(
+    SPACE_CHARSET,
+    ' ' * len(SPACE_CHARSET),
+    REMOVE_CHARSET)
+""" Translation table applying both space and remove charsets. """
+
+
+class Normalizer(object):
+    """ Normalization service. Tags normalized during ingestion are persisted
+    into a read-only cache file loaded by workers, while unseen tags are
+    normalized on demand and memoized. """
+
+    FILENAME = 'normalization.json'
+    """ Name of the persistent cache file within index directory. """
+
+    cache: Dict[str, str] = {}
+    """ Read-only normalized tags indexed by raw tag. """
+
+    tagger: MeCab.Tagger = None
+    """ Japanese parser, lazily created as only needed on cache miss. """
+
+    @classmethod
+    def tokenize(cls: type, text: str) -> str:
+        """ Splits the given japanese text into blank separated words.
+
+        Parameters
+        ----------
+        text: str
+            Japanese text to tokenize.
+
+        Returns
+        -------
+        tokenized: str
+            Tokenized text.
+        """
+        if cls.tagger is None:
+            cls.tagger = MeCab.Tagger('-Owakati')
+        return cls.tagger.parse(text).replace('\n', '').rstrip()
+
+    @classmethod
+    def compute(cls: type, tag: str) -> str:
+        """ Normalize the given tag by removing special chars and / or
+        replacing them by blank spaces. Assume that the given tag as the
+        following prefixed structure : `lang:tag`.
+
+        If the target lang is `ja` then it will performs an additional
+        normalization based on `MeCab wakiti` parser.
+
+        Parameters
+        ----------
+        tag: str
+            Tag to be normalized.
+
+        Returns
+        -------
+        normalized: str
+            Normalized tag.
+        """
+        lang = tag[:2]
+        normalized = tag[3:].lower().translate(TRANSLATION)
+        if lang == 'ja':
+            normalized = cls.tokenize(normalized)
+        return f'{lang}:{normalized}'
+
+    @classmethod
+    def load(cls: type, path: str) -> None:
+        """ Loads the persistent cache from the given file if any.
+
+        Parameters
+        ----------
+        path: str
+            Path of the cache file to load.
+        """
+        if exists(path):
+            with open(path, 'r') as stream:
+                cls.cache = json.load(stream)
+
+    @classmethod
+    def dump(cls: type, path: str, tags: Iterable[str]) -> None:
+        """ Normalizes the given tags and writes the persistent cache file.
+
+        Parameters
+        ----------
+        path: str
+            Path of the cache file to write.
+        tags: Iterable[str]
+            Tags to be normalized.
+        """
+        cache = {tag: cls.compute(tag) for tag in set(tags)}
+        with open(path, 'w') as stream:
+            json.dump(cache, stream, ensure_ascii=False)
+        cls.cache = cache
+
+
+@lru_cache(maxsize=configuration.NORMALIZATION_MEMO_SIZE)
+def memoized(tag: str) -> str:
+    """ Bounded memo of normalized tags missing from persistent cache. """
+    Metrics.increment('normalization_cache', 'result', 'miss')
+    return Normalizer.compute(tag)
+
+
+def normalize(tag: str) -> str:
+    """ Returns the normalized form of the given tag, see
+    `Normalizer.compute(tag)`.
+
+    Parameters
+    ----------
+    tag: str
+        Tag to be normalized.
+
+    Returns
+    -------
+    normalized: str
+        Normalized tag.
+
+    Notes
+    -----
+    No value check is performed for error handling. Thus invalid tag will lead
+    to IndexError exception.
+    """
+    normalized = Normalizer.cache.get(tag)
+    if normalized is None:
+        return memoized(tag)
+    return normalized
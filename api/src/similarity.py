@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Entity to entity similarity search based on aggregated tag embeddings.
+
+Entity vectors are partitioned into about `sqrt(n)` clusters using spherical
+k-means, and stored sorted by cluster so that each cluster is a contiguous
+slice of the memory mapped matrix. Search only scans the clusters whose
+centroids are the closest to the query (inverted file index), probing more
+clusters until enough entities match the requested locales.
+"""
+
+import json
+
+from os.path import exists, join
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from sklearn.cluster import MiniBatchKMeans
+
+from . import configuration
+from .artifacts import EMBEDDINGS, TAGS
+from .normalization import normalize
+
+METADATA = 'entities.json'
+""" Name of the entity identifiers, labels and locales file. """
+
+VECTORS = 'entities.npy'
+""" Name of the normalized entity vectors file. """
+
+FLAGS = 'entities_locales.npy'
+""" Name of the entity one-hot locale flags file. """
+
+CENTROIDS = 'entities_centroids.npy'
+""" Name of the normalized cluster centroids file. """
+
+OFFSETS = 'entities_offsets.npy'
+""" Name of the cluster boundaries file. """
+
+CLUSTER_MINIMUM = 1024
+""" Number of entities under which a single cluster is used. """
+
+CLUSTER_SAMPLE = 256
+""" Number of entities sampled per cluster to fit k-means. """
+
+ASSIGN_CHUNK = 65536
+""" Number of entities assigned to clusters at once. """
+
+
+def cluster(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Partitions the given normalized vectors into about `sqrt(n)`
+    clusters, using k-means fitted on a sample, each vector being assigned to
+    the centroid with highest cosine similarity.
+
+    Parameters
+    ----------
+    vectors: numpy.ndarray
+        Normalized vectors to partition.
+
+    Returns
+    -------
+    clusters: Tuple[numpy.ndarray, numpy.ndarray]
+        Normalized centroids and cluster of each vector.
+    """
+    if len(vectors) < CLUSTER_MINIMUM:
+        return (
+            np.zeros((1, vectors.shape[1]), dtype=np.float32),
+            np.zeros(len(vectors), dtype=np.int64))
+    count = int(np.sqrt(len(vectors)))
+    random = np.random.RandomState(0)
+    sample = vectors[random.choice(
+        len(vectors),
+        min(len(vectors), count * CLUSTER_SAMPLE),
+        replace=False)]
+    kmeans = MiniBatchKMeans(
+        n_clusters=count,
+        batch_size=4096,
+        n_init=3,
+        random_state=0)
+    centroids = kmeans.fit(sample).cluster_centers_.astype(np.float32)
+    centroids /= np.maximum(
+        np.linalg.norm(centroids, axis=1, keepdims=True),
+        np.finfo(np.float32).eps)
+    assignments = np.concatenate([
+        np.argmax(vectors[i:i + ASSIGN_CHUNK] @ centroids.T, axis=1)
+        for i in range(0, len(vectors), ASSIGN_CHUNK)])
+    return centroids, assignments
+
+
+def write(
+        directory: str,
+        entities: List[Dict],
+        locales: List[str]) -> List[str]:
+    """ Derives entity vectors from tag embeddings and writes them along with
+    entity locale flags and cluster index. Each entity vector is the average
+    of its per locale tag embeddings average, L2 normalized so that dot
+    product is cosine similarity. Entities without any known tag are skipped.
+
+    Parameters
+    ----------
+    directory: str
+        Directory to write files into, which must contain binary embeddings.
+    entities: List[Dict]
+        Entities as dict with `eid`, `label`, `tagsets` and `onehot` keys.
+    locales: List[str]
+        Supported locales, used as flag columns.
+
+    Returns
+    -------
+    files: List[str]
+        Names of written files.
+    """
+    with open(join(directory, TAGS), 'r') as stream:
+        rows = {tag: i for i, tag in enumerate(json.load(stream))}
+    embeddings = np.load(join(directory, EMBEDDINGS))
+    eids, labels, vectors, flags = [], [], [], []
+    for entity in entities:
+        aggregates = []
+        for tags in entity['tagsets'].values():
+            indices = [
+                rows[tag]
+                for tag in map(normalize, tags)
+                if tag in rows]
+            if len(indices) > 0:
+                aggregates.append(embeddings[indices].mean(axis=0))
+        if len(aggregates) == 0:
+            continue
+        vector = np.mean(aggregates, axis=0)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            continue
+        eids.append(entity['eid'])
+        labels.append(entity['label'])
+        vectors.append(vector / norm)
+        flags.append([entity['onehot'][locale] for locale in locales])
+    vectors = np.array(vectors, dtype=np.float32).reshape(
+        -1,
+        embeddings.shape[1])
+    flags = np.array(flags, dtype=bool).reshape(-1, len(locales))
+    centroids, clusters = cluster(vectors)
+    order = np.argsort(clusters, kind='stable')
+    offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(clusters, minlength=len(centroids)))
+    np.save(join(directory, VECTORS), vectors[order])
+    np.save(join(directory, FLAGS), flags[order])
+    np.save(join(directory, CENTROIDS), centroids)
+    np.save(join(directory, OFFSETS), offsets)
+    with open(join(directory, METADATA), 'w') as stream:
+        json.dump(
+            {
+                'eids': [eids[i] for i in order],
+                'labels': [labels[i] for i in order],
+                'locales': locales},
+            stream,
+            ensure_ascii=False)
+    return [METADATA, VECTORS, FLAGS, CENTROIDS, OFFSETS]
+
+
+class SimilarityIndex(object):
+    """ Inverted file nearest neighbour index over memory mapped entity
+    vectors. """
+
+    def __init__(self, directory: str):
+        """ Default constructor. Bundles without cluster files are searched
+        exhaustively, as a single cluster.
+
+        Parameters
+        ----------
+        directory: str
+            Directory to load entity vectors and flags from.
+
+        Raises
+        ------
+        IOError
+            If similarity files are not found.
+        """
+        path = join(directory, METADATA)
+        if not exists(path):
+            raise IOError('Entity similarity index not found')
+        with open(path, 'r') as stream:
+            metadata = json.load(stream)
+        self._eids = metadata['eids']
+        self._labels = metadata['labels']
+        self._locales = {
+            locale: i
+            for i, locale in enumerate(metadata['locales'])}
+        self._rows = {eid: i for i, eid in enumerate(self._eids)}
+        self._vectors = np.load(join(directory, VECTORS), mmap_mode='r')
+        self._flags = np.load(join(directory, FLAGS), mmap_mode='r')
+        if exists(join(directory, CENTROIDS)):
+            self._centroids = np.load(join(directory, CENTROIDS))
+            self._offsets = np.load(join(directory, OFFSETS))
+        else:
+            self._centroids = np.zeros(
+                (1, self._vectors.shape[1]),
+                dtype=np.float32)
+            self._offsets = np.array([0, len(self._eids)], dtype=np.int64)
+
+    def _members(self, clusters: np.ndarray) -> np.ndarray:
+        """ Returns rows of the given clusters.
+
+        Parameters
+        ----------
+        clusters: numpy.ndarray
+            Clusters to get rows of.
+
+        Returns
+        -------
+        rows: numpy.ndarray
+            Rows of the given clusters.
+        """
+        starts = self._offsets[clusters]
+        lengths = self._offsets[clusters + 1] - starts
+        shifts = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return shifts + np.arange(lengths.sum())
+
+    def search(
+            self,
+            eid: str,
+            sources: List[str],
+            target: str,
+            k: int) -> List[Dict[str, Any]]:
+        """ Finds the most similar entities to the given one, available in
+        target locale and at least one of source locales. Clusters are
+        scanned by decreasing centroid similarity, starting with
+        `SIMILARITY_PROBES` clusters and doubling until `k` entities match.
+
+        Parameters
+        ----------
+        eid: str
+            Identifier of the entity to find neighbours for.
+        sources: List[str]
+            Source locales, at least one must be available.
+        target: str
+            Target locale which must be available.
+        k: int
+            Maximum number of neighbours to return.
+
+        Returns
+        -------
+        neighbours: List[Dict[str, Any]]
+            Neighbours as dict with `eid`, `label` and `score` keys, sorted by
+            decreasing similarity.
+
+        Raises
+        ------
+        KeyError
+            If entity is unknown.
+        ValueError
+            If one of the locales is unknown.
+        """
+        row = self._rows[eid]
+        unknown = [
+            locale
+            for locale in [target] + sources
+            if locale not in self._locales]
+        if len(unknown) > 0:
+            raise ValueError(f'Unsupported locales {", ".join(unknown)}')
+        columns = [self._locales[source] for source in sources]
+        query = np.asarray(self._vectors[row])
+        order = np.argsort(-(self._centroids @ query))
+        candidates = []
+        found = 0
+        probed = 0
+        probes = max(configuration.SIMILARITY_PROBES, 1)
+        while probed < len(order) and found < k:
+            members = self._members(order[probed:probes])
+            flags = self._flags[members]
+            mask = flags[:, self._locales[target]] & np.any(
+                flags[:, columns],
+                axis=1)
+            mask &= members != row
+            candidates.append(members[mask])
+            found += int(mask.sum())
+            probed = probes
+            probes *= 2
+        if found == 0:
+            return []
+        candidates = np.concatenate(candidates)
+        scores = self._vectors[candidates] @ query
+        k = min(k, found)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [{
+            'eid': self._eids[candidates[i]],
+            'label': self._labels[candidates[i]],
+            'score': float(scores[i])}
+            for i in top]
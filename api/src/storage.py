@@ -6,6 +6,35 @@
 from redis import Redis
 
 from . import configuration
+from .metrics import Metrics
 
-storage: Redis = Redis(host=configuration.REDIS_HOST)
+
+class InstrumentedRedis(Redis):
+    """ Redis client that records every executed command. """
+
+    def execute_command(self, *args, **options):
+        """ Record command name before delegating to `Redis`. """
+        Metrics.command(str(args[0]).upper())
+        return super().execute_command(*args, **options)
+
+
+storage: Redis = InstrumentedRedis(host=configuration.REDIS_HOST)
 """ API storage. """
+
+replica: Redis = InstrumentedRedis(host=configuration.REDIS_REPLICA_HOST)
+""" API read only storage, which is the primary storage if no replica. """
+
+
+def select(db: int) -> None:
+    """ Binds both storage clients to the given database. Pooled connections
+    are dropped so that subsequent commands are sent to this database.
+
+    Parameters
+    ----------
+    db: int
+        Index of the database to use.
+    """
+    for client in (storage, replica):
+        client.connection_pool.connection_kwargs['db'] = db
+        client.connection_pool.disconnect()
+        client.connection_pool.reset()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Offline bulk translation script.
+
+Streams a catalogue of (item id, `locale:tag` list) records through
+`GenreMapper` and writes top `k` target tags for each item:
+
+    python -m muzeeglot.translate items.jsonl output.jsonl --target en
+
+Records are read from JSONL (`{"id": ..., "tags": [...]}` per line) or CSV
+(`id,tags` header, tags as JSON list) files, depending on file extension, and
+written using the same convention. Progress is checkpointed after each batch
+so that an interrupted job resumes where it stopped when run again with the
+same parameters.
+
+The mapper is built by the main process before starting workers, which
+inherit it, so that any artifact or locale error aborts the job up front.
+"""
+
+import csv
+import json
+import time
+
+from argparse import ArgumentParser
+from collections import deque
+from io import StringIO
+from itertools import islice
+from multiprocessing import Pool
+from os import replace
+from os.path import abspath, exists, join
+from typing import Any, Dict, Iterator, List, Tuple
+
+from . import artifacts
+from .mapper import GenreMapper
+from .normalization import Normalizer
+from .types import Language, Tags
+
+mapper: GenreMapper = None
+""" Mapper instance, built by main process and inherited by workers. """
+
+
+def prepare(sources: List[str], target: str) -> GenreMapper:
+    """ Resolves artifacts and builds mapper, using precomputed artifacts if
+    available.
+
+    Parameters
+    ----------
+    sources: List[str]
+        List of source languages to map genre from.
+    target: str
+        Target language to map genre to.
+
+    Returns
+    -------
+    mapper: GenreMapper
+        Built mapper.
+
+    Raises
+    ------
+    ValueError
+        If one of the locales is not supported.
+    """
+    directory = artifacts.resolve()
+    supported = Language.locales()
+    unknown = [
+        locale
+        for locale in sources + [target]
+        if locale not in supported]
+    if len(unknown) > 0:
+        raise ValueError(f'Unsupported locales {", ".join(unknown)}')
+    Normalizer.load(join(directory, Normalizer.FILENAME))
+    GenreMapper.directory = directory
+    return GenreMapper.get(sources, target, Tags.from_locale)
+
+
+def initialize(sources: List[str], target: str) -> None:
+    """ Worker process initializer that builds mapper if not inherited from
+    main process, which is the case for spawned workers.
+
+    Parameters
+    ----------
+    sources: List[str]
+        List of source languages to map genre from.
+    target: str
+        Target language to map genre to.
+    """
+    global mapper
+    if mapper is None:
+        mapper = prepare(sources, target)
+
+
+def translate(batch: List[List[str]], k: int) -> List[List[str]]:
+    """ Worker process task, see `GenreMapper.predict_batch(batch, k)`. """
+    return mapper.predict_batch(batch, k)
+
+
+def read(path: str) -> Iterator[Tuple[str, List[str]]]:
+    """ Lazily reads records from the given CSV or JSONL file.
+
+    Parameters
+    ----------
+    path: str
+        Path of the file to read.
+
+    Returns
+    -------
+    records: Iterator[Tuple[str, List[str]]]
+        Records as (item id, tags) pairs.
+    """
+    with open(path, 'r') as stream:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(stream):
+                yield row['id'], json.loads(row['tags'])
+        else:
+            for line in stream:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record['id'], record['tags']
+
+
+def format_records(
+        path: str,
+        ids: List[str],
+        predictions: List[List[str]]) -> bytes:
+    """ Formats output records according to output file extension.
+
+    Parameters
+    ----------
+    path: str
+        Path of the output file.
+    ids: List[str]
+        Item identifiers.
+    predictions: List[List[str]]
+        Predictions for each item.
+
+    Returns
+    -------
+    payload: bytes
+        Encoded records.
+    """
+    buffer = StringIO()
+    if path.endswith('.csv'):
+        writer = csv.writer(buffer, lineterminator='\n')
+        for eid, tags in zip(ids, predictions):
+            writer.writerow([eid, json.dumps(tags, ensure_ascii=False)])
+    else:
+        for eid, tags in zip(ids, predictions):
+            record = {'id': eid, 'predictions': tags}
+            buffer.write(f'{json.dumps(record, ensure_ascii=False)}\n')
+    return buffer.getvalue().encode()
+
+
+def load_checkpoint(
+        path: str,
+        parameters: Dict[str, Any]) -> Tuple[int, int]:
+    """ Loads checkpoint if any.
+
+    Parameters
+    ----------
+    path: str
+        Path of the checkpoint file.
+    parameters: Dict[str, Any]
+        Parameters of the job to resume.
+
+    Returns
+    -------
+    checkpoint: Tuple[int, int]
+        Number of processed items and output file size.
+
+    Raises
+    ------
+    ValueError
+        If checkpoint was written by a job with other parameters.
+    """
+    if not exists(path):
+        return 0, 0
+    with open(path, 'r') as stream:
+        checkpoint = json.load(stream)
+    if checkpoint.get('parameters') != parameters:
+        raise ValueError(
+            f'Checkpoint {path} was written with parameters '
+            f'{checkpoint.get("parameters")}, remove it to start over')
+    return checkpoint['items'], checkpoint['offset']
+
+
+def save_checkpoint(
+        path: str,
+        parameters: Dict[str, Any],
+        items: int,
+        offset: int) -> None:
+    """ Atomically writes checkpoint.
+
+    Parameters
+    ----------
+    path: str
+        Path of the checkpoint file.
+    parameters: Dict[str, Any]
+        Parameters of the running job.
+    items: int
+        Number of processed items.
+    offset: int
+        Output file size.
+    """
+    with open(f'{path}.tmp', 'w') as stream:
+        json.dump(
+            {'parameters': parameters, 'items': items, 'offset': offset},
+            stream)
+    replace(f'{path}.tmp', path)
+
+
+def run(
+        source: str,
+        output: str,
+        sources: List[str],
+        target: str,
+        k: int,
+        batch_size: int,
+        workers: int) -> None:
+    """ Runs bulk translation.
+
+    Parameters
+    ----------
+    source: str
+        Path of the input file.
+    output: str
+        Path of the output file.
+    sources: List[str]
+        List of source languages to map genre from.
+    target: str
+        Target language to map genre to.
+    k: int
+        Maximum number of predictions per item.
+    batch_size: int
+        Number of items per batch.
+    workers: int
+        Number of worker processes.
+    """
+    global mapper
+    checkpoint = f'{output}.checkpoint'
+    parameters = {
+        'input': abspath(source),
+        'sources': sources,
+        'target': target,
+        'k': k}
+    processed, offset = load_checkpoint(checkpoint, parameters)
+    mapper = prepare(sources, target)
+    if processed > 0:
+        print(f'INFO: resume after {processed} items')
+        with open(output, 'r+b') as stream:
+            stream.truncate(offset)
+    else:
+        with open(output, 'wb') as stream:
+            if output.endswith('.csv'):
+                stream.write(b'id,predictions\n')
+    records = islice(read(source), processed, None)
+    start = time.perf_counter()
+    done = 0
+    pending = deque()
+    with Pool(workers, initialize, (sources, target)) as pool:
+        with open(output, 'ab') as stream:
+            while True:
+                batch = list(islice(records, batch_size))
+                if len(batch) > 0:
+                    ids = [record[0] for record in batch]
+                    tagsets = [record[1] for record in batch]
+                    pending.append((
+                        ids,
+                        pool.apply_async(translate, (tagsets, k))))
+                # NOTE: bound in-flight batches to keep memory bounded.
+                while pending and (
+                        len(batch) == 0 or len(pending) > 2 * workers):
+                    ids, result = pending.popleft()
+                    stream.write(format_records(output, ids, result.get()))
+                    stream.flush()
+                    done += len(ids)
+                    save_checkpoint(
+                        checkpoint,
+                        parameters,
+                        processed + done,
+                        stream.tell())
+                    rate = done / (time.perf_counter() - start)
+                    print(
+                        f'INFO: {processed + done} items translated '
+                        f'({rate:.0f} items/sec)')
+                if len(batch) == 0:
+                    break
+    print(f'INFO: translation done, {processed + done} items')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Muzeeglot bulk translation')
+    parser.add_argument('input', help='input CSV or JSONL file')
+    parser.add_argument('output', help='output CSV or JSONL file')
+    parser.add_argument('--target', required=True)
+    parser.add_argument(
+        '--sources',
+        nargs='+',
+        help='source locales, default to all locales but target')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--batch', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    artifacts.resolve()
+    sources = args.sources or [
+        locale
+        for locale in Language.locales()
+        if locale != args.target]
+    run(
+        args.input,
+        args.output,
+        sources,
+        args.target,
+        args.k,
+        args.batch,
+        args.workers)
@@ -6,11 +6,15 @@
 import re
 import requests
 
-from typing import Any, Dict, List, Optional
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
 
 from pydantic import constr
 
-from .storage import storage
+from . import configuration
+from .layout import DICTIONARY_KEY, unpack
+from .metrics import Metrics
+from .storage import replica
 
 EntityId = constr(
     min_length=32,
@@ -34,10 +38,10 @@ class Language(object):
         locales: List[str]
             List of locale available in storage.
         """
-        length = storage.llen('locales')
+        length = replica.llen('locales')
         return [
             locale.decode()
-            for locale in storage.lrange('locales', 0, length)]
+            for locale in replica.lrange('locales', 0, length)]
 
     @staticmethod
     def label(locale: Locale) -> str:
@@ -58,7 +62,7 @@ class Language(object):
         ValueError
             If no label exist for this locale.
         """
-        label = storage.get(f'locale:{locale}')
+        label = replica.get(f'locale:{locale}')
         if label is None:
             raise ValueError()
         return label.decode()
@@ -77,6 +81,82 @@ class Language(object):
             for locale in cls.locales()]
 
 
+class TagDictionary(object):
+    """ Compact layout tag dictionary, lazily loaded from storage. As it is
+    append only it is kept in memory once loaded, and only reloaded when an
+    unknown identifier is met. An empty dictionary is never kept, as it means
+    storage is not ingested (or replica not synchronized) yet. """
+
+    names: List[str] = []
+    """ Tag names indexed by tag identifier. """
+
+    ids: Dict[str, int] = {}
+    """ Tag identifiers indexed by tag name. """
+
+    @classmethod
+    def load(cls: type, force: bool = False) -> List[str]:
+        """ Loads dictionary from storage if not already loaded.
+
+        Parameters
+        ----------
+        force: bool
+            If `True` dictionary is reloaded even if already loaded.
+
+        Returns
+        -------
+        names: List[str]
+            Tag names indexed by tag identifier, empty if not available.
+        """
+        if force or len(cls.names) == 0:
+            names = [
+                name.decode()
+                for name in replica.lrange(DICTIONARY_KEY, 0, -1)]
+            cls.ids = {name: i for i, name in enumerate(names)}
+            cls.names = names
+        return cls.names
+
+    @classmethod
+    def decode(cls: type, packed: Optional[bytes]) -> List[str]:
+        """ Decodes packed tag identifiers into tag names.
+
+        Parameters
+        ----------
+        packed: Optional[bytes]
+            Packed tag identifiers if any.
+
+        Returns
+        -------
+        tags: List[str]
+            List of tag names.
+        """
+        if packed is None:
+            return []
+        ids = unpack(packed)
+        names = cls.load()
+        if len(ids) > 0 and max(ids) >= len(names):
+            names = cls.load(force=True)
+        return [names[i] for i in ids]
+
+    @classmethod
+    def contains(cls: type, locale: str, tag: str) -> bool:
+        """ Indicates if the given tag exists for the given locale.
+
+        Parameters
+        ----------
+        locale: str
+            Locale to check tag for.
+        tag: str
+            Tag to check.
+
+        Returns
+        -------
+        contains: bool
+            `True` if tag exists for this locale, `False` otherwise.
+        """
+        cls.load()
+        return tag.startswith(f'{locale}:') and tag in cls.ids
+
+
 class Tags(object):
     """ Tag representation. """
 
@@ -116,9 +196,34 @@ class Tags(object):
         tags: List[str]
             List of tags.
         """
+        if configuration.STORAGE_LAYOUT == 'compact':
+            prefix = f'{locale}:'
+            return [
+                tag
+                for tag in TagDictionary.load()
+                if tag.startswith(prefix)]
         return [
             tag.decode()
-            for tag in storage.smembers(f'tags:{locale}')]
+            for tag in replica.smembers(f'tags:{locale}')]
+
+    @staticmethod
+    def filter(locale: str) -> Callable[[str], bool]:
+        """ Creates a predicate that indicates if a tag exists for the given
+        locale.
+
+        Parameters
+        ----------
+        locale: str
+            Locale to filter tag for.
+
+        Returns
+        -------
+        tfilter: Callable[[str], bool]
+            Filtering predicate.
+        """
+        if configuration.STORAGE_LAYOUT == 'compact':
+            return partial(TagDictionary.contains, locale)
+        return partial(replica.sismember, f'tags:{locale}')
 
     @staticmethod
     def from_entities(eid: EntityId, locale: Locale) -> List[str]:
@@ -136,9 +241,12 @@ class Tags(object):
         tags: List[str]
             List of tag for this (entity, locale) pair
         """
+        if configuration.STORAGE_LAYOUT == 'compact':
+            return TagDictionary.decode(
+                replica.hget(f'entity:{eid}', f'{locale}:tags'))
         key = f'{eid}:{locale}:tags'
-        length = storage.llen(key)
-        return [tag.decode() for tag in storage.lrange(key, 0, length)]
+        length = replica.llen(key)
+        return [tag.decode() for tag in replica.lrange(key, 0, length)]
 
 
 class Entity(object):
@@ -178,7 +286,8 @@ class Entity(object):
         url = (
             f'https://{locale}.{cls.QUERY_ENDPOINT}'
             f'?{cls.QUERY_PARAMETERS}&titles={name}')
-        response = requests.get(url)
+        with Metrics.span('entity.wikipedia'):
+            response = requests.get(url)
         if response.status_code == 200:
             payload = response.json()
             if 'query' in payload and 'pages' in payload['query']:
@@ -211,6 +320,31 @@ class Entity(object):
         name = name.replace('_', ' ')  # Note: replace _ by whitespace.
         return name
 
+    @staticmethod
+    def metadata(eid: EntityId) -> List[Dict[str, Any]]:
+        """ Retrieve entity metadata from compact layout storage, using a
+        single hash read.
+
+        Parameters
+        ----------
+        eid: EntityId
+            Unique entity identifier.
+
+        Returns
+        -------
+        metadata: List[Dict[str, Any]]
+            Entity URI and tags per locale.
+        """
+        fields = {
+            key.decode(): value
+            for key, value in replica.hgetall(f'entity:{eid}').items()}
+        return [{
+            'locale': locale,
+            'uri': fields[locale].decode(),
+            'tags': TagDictionary.decode(fields.get(f'{locale}:tags'))}
+            for locale in Language.locales()
+            if locale in fields]
+
     @classmethod
     def get(cls: type, eid: EntityId) -> Dict[str, Any]:
         """ Retrieve entity with identifier from storage.
@@ -225,12 +359,16 @@ class Entity(object):
         entity: Dict[str, Any]
             Entity as dict with cover and metadata.
         """
-        metadata = [{
-            'locale': locale,
-            'uri': storage.get(f'{eid}:{locale}').decode(),
-            'tags': Tags.from_entities(eid, locale)}
-            for locale in Language.locales()
-            if storage.get(f'{eid}:{locale}') is not None]
+        with Metrics.span('entity.redis'):
+            if configuration.STORAGE_LAYOUT == 'compact':
+                metadata = cls.metadata(eid)
+            else:
+                metadata = [{
+                    'locale': locale,
+                    'uri': replica.get(f'{eid}:{locale}').decode(),
+                    'tags': Tags.from_entities(eid, locale)}
+                    for locale in Language.locales()
+                    if replica.get(f'{eid}:{locale}') is not None]
         cover = None
         covers = []
         for localized in metadata:
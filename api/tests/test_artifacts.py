@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Unit tests for artifacts module. """
+
+import json
+
+import fakeredis
+import pytest
+
+from src import artifacts, configuration
+from src.storage import replica, select, storage
+
+
+@pytest.fixture
+def bundles(tmp_path, monkeypatch):
+    """ Empty bundles root directory, with restored storage database. """
+    monkeypatch.setattr(configuration, 'ARTIFACTS', str(tmp_path))
+    monkeypatch.setattr(configuration, 'ARTIFACTS_VERSION', 'latest')
+    monkeypatch.setattr(configuration, 'STORAGE_LAYOUT', 'legacy')
+    yield tmp_path
+    select(0)
+
+
+def publish(version, db):
+    """ Publishes an empty bundle. """
+    directory = artifacts.staging(version)
+    artifacts.publish(directory, version, [], db)
+
+
+def test_resolve(bundles):
+    """ Latest bundle is resolved and storage bound to its database. """
+    publish('1', 1)
+    publish('2', 2)
+    assert artifacts.resolve() == str(bundles / '2')
+    for client in (storage, replica):
+        assert client.connection_pool.connection_kwargs['db'] == 2
+        assert client.connection_pool.make_connection().db == 2
+    with open(bundles / '2' / artifacts.MANIFEST, 'r') as stream:
+        assert json.load(stream)['redis_db'] == 2
+
+
+def test_resolve_layout(bundles, monkeypatch):
+    """ Bundle ingested with another layout is refused. """
+    publish('1', 1)
+    monkeypatch.setattr(configuration, 'STORAGE_LAYOUT', 'compact')
+    with pytest.raises(ValueError):
+        artifacts.resolve()
+
+
+def test_allocate(bundles, monkeypatch):
+    """ Allocated database is empty and not used by any bundle. """
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        artifacts,
+        'Redis',
+        lambda host, db: fakeredis.FakeRedis(server=server, db=db))
+    publish('1', 1)
+    fakeredis.FakeRedis(server=server, db=2).set('leftover', 1)
+    assert artifacts.allocate() == 3
+    monkeypatch.setattr(configuration, 'REDIS_DATABASES', 3)
+    with pytest.raises(IOError):
+        artifacts.allocate()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Unit tests for storage layouts and migration. """
+
+import fakeredis
+import pytest
+
+from src import configuration, migrate, types
+from src.layout import (
+    DICTIONARY_KEY,
+    CompactLayout,
+    LegacyLayout,
+    pack,
+    unpack)
+from src.types import Entity, Language, TagDictionary, Tags
+
+LOCALES = ['fr', 'en', 'ja']
+""" Locales of the test corpus. """
+
+CORPUS = {
+    'a' * 32: (
+        {'en': 'http://dbpedia.org/resource/Daft_Punk',
+         'fr': 'http://fr.dbpedia.org/resource/Daft_Punk'},
+        {'en': ['en:House_music', 'en:Electronica'],
+         'fr': ['fr:House', 'fr:Musique_électronique', 'fr:Disco'],
+         'ja': ['ja:ハウス']}),
+    'b' * 32: (
+        {'ja': 'http://ja.dbpedia.org/resource/X_JAPAN'},
+        {'ja': ['ja:ヘヴィメタル', 'ja:ハウス'],
+         'en': []})}
+""" Test corpus as (URIs, tagsets) indexed by entity identifier. """
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    """ Fake storage bound to read helpers and migration. """
+    client = fakeredis.FakeRedis()
+    client.lpush('locales', *LOCALES)
+    monkeypatch.setattr(types, 'replica', client)
+    monkeypatch.setattr(migrate, 'storage', client)
+    monkeypatch.setattr(TagDictionary, 'names', [])
+    monkeypatch.setattr(TagDictionary, 'ids', {})
+    return client
+
+
+def ingest(client, layout):
+    """ Writes test corpus with the given layout. """
+    layout.write_tags({
+        locale: [
+            tag
+            for _, tagsets in CORPUS.values()
+            for tag in tagsets.get(locale, [])]
+        for locale in LOCALES})
+    for eid, (uris, tagsets) in CORPUS.items():
+        layout.write_entity(eid, uris, tagsets)
+
+
+def snapshot():
+    """ Reads everything through read helpers. """
+    return {
+        'locales': {
+            locale: sorted(Tags.from_locale(locale))
+            for locale in Language.locales()},
+        'entities': {
+            eid: {
+                locale: Tags.from_entities(eid, locale)
+                for locale in LOCALES}
+            for eid in CORPUS},
+        'filter': [
+            Tags.filter('fr')(tag)
+            for tag in ('fr:House', 'en:House_music', 'fr:Unknown')]}
+
+
+def metadata(layout):
+    """ Reads entities metadata as `Entity.get` does, without covers. """
+    if layout == 'compact':
+        return {eid: Entity.metadata(eid) for eid in CORPUS}
+    return {
+        eid: [{
+            'locale': locale,
+            'uri': types.replica.get(f'{eid}:{locale}').decode(),
+            'tags': Tags.from_entities(eid, locale)}
+            for locale in Language.locales()
+            if types.replica.get(f'{eid}:{locale}') is not None]
+        for eid in CORPUS}
+
+
+@pytest.mark.parametrize('ids', [[], [0], [1, 2, 70000, 2 ** 32 - 1]])
+def test_pack(ids):
+    """ Packed identifiers are 4 bytes each and round trip. """
+    packed = pack(ids)
+    assert len(packed) == 4 * len(ids)
+    assert unpack(packed) == ids
+
+
+def test_round_trip(storage, monkeypatch):
+    """ Both layouts are read identically. """
+    ingest(storage, LegacyLayout(storage))
+    legacy = snapshot(), metadata('legacy')
+    storage.flushdb()
+    storage.lpush('locales', *LOCALES)
+    monkeypatch.setattr(configuration, 'STORAGE_LAYOUT', 'compact')
+    ingest(storage, CompactLayout(storage))
+    assert (snapshot(), metadata('compact')) == legacy
+    assert legacy[0]['entities']['a' * 32]['fr'] == [
+        'fr:Disco', 'fr:Musique_électronique', 'fr:House']
+    assert legacy[0]['filter'] == [True, False, False]
+
+
+def test_write_tags_append_only(storage):
+    """ Dictionary identifiers are stable and never emptied. """
+    CompactLayout(storage).write_tags({'fr': ['fr:b', 'fr:a']})
+    CompactLayout(storage).write_tags({})
+    CompactLayout(storage).write_tags({'fr': ['fr:c', 'fr:a']})
+    assert storage.lrange(DICTIONARY_KEY, 0, -1) == [
+        b'fr:a', b'fr:b', b'fr:c']
+
+
+def test_migration(storage, monkeypatch):
+    """ Migration is equivalent to compact ingestion, and idempotent. """
+    ingest(storage, LegacyLayout(storage))
+    expected = snapshot(), metadata('legacy')
+    migrate.migrate(keep=False)
+    monkeypatch.setattr(configuration, 'STORAGE_LAYOUT', 'compact')
+    assert sorted(storage.keys()) == sorted([
+        b'locales', DICTIONARY_KEY.encode()] + [
+        f'entity:{eid}'.encode() for eid in CORPUS])
+    assert (snapshot(), metadata('compact')) == expected
+    dictionary = storage.lrange(DICTIONARY_KEY, 0, -1)
+    migrate.migrate(keep=False)
+    monkeypatch.setattr(TagDictionary, 'names', [])
+    assert storage.lrange(DICTIONARY_KEY, 0, -1) == dictionary
+    assert (snapshot(), metadata('compact')) == expected
+
+
+def test_migration_keep(storage, monkeypatch):
+    """ Migration can be resumed after a run keeping legacy keys. """
+    ingest(storage, LegacyLayout(storage))
+    expected = snapshot()
+    migrate.migrate(keep=True)
+    migrate.migrate(keep=False)
+    monkeypatch.setattr(configuration, 'STORAGE_LAYOUT', 'compact')
+    assert snapshot() == expected
+
+
+def test_empty_dictionary_not_cached(storage):
+    """ Dictionary is loaded again until storage is ingested. """
+    assert TagDictionary.load() == []
+    storage.rpush(DICTIONARY_KEY, 'fr:a')
+    assert TagDictionary.load() == ['fr:a']
+    storage.rpush(DICTIONARY_KEY, 'fr:b')
+    assert TagDictionary.decode(pack([1, 0])) == ['fr:b', 'fr:a']
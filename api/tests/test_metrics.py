@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Unit tests for metrics module. """
+
+import json
+import subprocess
+
+from os import getpid
+
+from src.metrics import SECONDS_BUCKETS, Histogram, Metrics
+
+
+def test_histogram_render():
+    """ Buckets are cumulative and followed by +Inf, sum and count. """
+    histogram = Histogram((1, 5))
+    for value in (0.5, 2, 10):
+        histogram.observe(value)
+    assert histogram.render('requests', 'endpoint="predict"') == [
+        'requests_bucket{endpoint="predict",le="1"} 1',
+        'requests_bucket{endpoint="predict",le="5"} 2',
+        'requests_bucket{endpoint="predict",le="+Inf"} 3',
+        'requests_sum{endpoint="predict"} 12.5',
+        'requests_count{endpoint="predict"} 3']
+
+
+def test_request_context():
+    """ Spans and commands are recorded into current request context. """
+    context = Metrics.begin()
+    with Metrics.span('test.span'):
+        Metrics.command('GET')
+    Metrics.command('GET')
+    Metrics.end('test_endpoint', context, 0.01)
+    assert context['commands'] == 2
+    assert 'test.span' in context['spans']
+    payload = Metrics.render()
+    assert 'muzeeglot_span_seconds_count{span="test.span"} 1' in payload
+    assert 'muzeeglot_request_redis_commands_sum' \
+        '{endpoint="test_endpoint"} 2' in payload
+    assert Metrics.summary(context).startswith('redis=2 test.span=')
+
+
+def test_shared_render(tmp_path, monkeypatch):
+    """ Snapshots of other workers are merged, gauges only for live ones. """
+    monkeypatch.setattr(Metrics, 'counters', {('test', 'kind', 'a'): 2})
+    monkeypatch.setattr(Metrics, 'spans', {})
+    monkeypatch.setattr(Metrics, 'requests', {})
+    monkeypatch.setattr(Metrics, 'commands', {})
+    monkeypatch.setattr(Metrics, 'gauges', {'instances': 1})
+    monkeypatch.setattr(Metrics, 'directory', str(tmp_path))
+    monkeypatch.setattr(Metrics, 'snapshot', str(tmp_path / 'self.json'))
+    Metrics.observe('test.span', 0.002)
+    exited = subprocess.Popen(['true'])
+    exited.wait()
+    histogram = Histogram(SECONDS_BUCKETS)
+    histogram.observe(0.2)
+    with open(tmp_path / 'other.json', 'w') as stream:
+        json.dump({
+            'pid': exited.pid,
+            'spans': {'test.span': histogram.dump()},
+            'requests': {},
+            'commands': {},
+            'counters': [['test', 'kind', 'a', 3], ['test', 'kind', 'b', 1]],
+            'gauges': {'instances': 5}},
+            stream)
+    payload = Metrics.render()
+    assert 'muzeeglot_test_total{kind="a"} 5' in payload
+    assert 'muzeeglot_test_total{kind="b"} 1' in payload
+    assert 'muzeeglot_span_seconds_count{span="test.span"} 2' in payload
+    assert 'muzeeglot_span_seconds_bucket{span="test.span",le="0.1"} 1' \
+        in payload
+    assert f'muzeeglot_instances{{pid="{getpid()}"}} 1' in payload
+    assert f'pid="{exited.pid}"' not in payload
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Unit tests for normalization module. """
+
+import MeCab
+import pytest
+
+from src.normalization import (
+    REMOVE_CHARSET,
+    SPACE_CHARSET,
+    Normalizer,
+    normalize)
+
+TAGS = [
+    'en:Hip_hop_soul',
+    'en:Rock_(music)',
+    'es:Rock_and_roll/Pop',
+    'fr:Musique_d\'ambiance',
+    'fr:R&B_contemporain',
+    'en:Drum_‘n’_bass!',
+    'cs:Folk,_Country',
+    'ja:ロックンロール',
+    'ja:ヘヴィ・メタル',
+    'ja:J-POP_(日本のポピュラー音楽)']
+""" Tags covering every special char and japanese tokenization. """
+
+
+def reference(tag: str) -> str:
+    """ Per character normalization loop, prior to translation table. """
+    wakati = MeCab.Tagger('-Owakati')
+    lang = tag[:2]
+    tag = tag[3:].lower()
+    normalized = []
+    for c in tag:
+        if c in SPACE_CHARSET:
+            normalized.append(' ')
+        elif c not in REMOVE_CHARSET:
+            normalized.append(c)
+    normalized = ''.join(normalized)
+    if lang == 'ja':
+        normalized = wakati.parse(normalized).replace('\n', '').rstrip()
+    return f'{lang}:{normalized}'
+
+
+@pytest.mark.parametrize('tag', TAGS)
+def test_compute(tag):
+    """ Translation table based normalization matches reference loop. """
+    assert Normalizer.compute(tag) == reference(tag)
+
+
+def test_persistent_cache(tmp_path, monkeypatch):
+    """ Cached tags are served from persistent cache without computing. """
+    path = str(tmp_path / Normalizer.FILENAME)
+    Normalizer.dump(path, TAGS)
+    monkeypatch.setattr(Normalizer, 'cache', {})
+    Normalizer.load(path)
+    assert Normalizer.cache == {tag: reference(tag) for tag in TAGS}
+    monkeypatch.setattr(Normalizer, 'compute', None)
+    assert [normalize(tag) for tag in TAGS] == [reference(t) for t in TAGS]
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Unit tests for similarity module. """
+
+import json
+
+import numpy as np
+import pytest
+
+from src import configuration
+from src.artifacts import EMBEDDINGS, TAGS
+from src.similarity import FLAGS, VECTORS, SimilarityIndex, write
+
+LOCALES = ['fr', 'en', 'ja']
+""" Locales of the test corpus. """
+
+
+@pytest.fixture(scope='module')
+def directory(tmp_path_factory):
+    """ Similarity index of a random corpus large enough to be clustered. """
+    directory = tmp_path_factory.mktemp('similarity')
+    random = np.random.RandomState(0)
+    tags = [f'{locale}:tag{i}' for locale in LOCALES for i in range(100)]
+    with open(directory / TAGS, 'w') as stream:
+        json.dump(tags, stream)
+    np.save(directory / EMBEDDINGS, random.randn(len(tags), 16))
+    entities = []
+    for i in range(3000):
+        onehot = {locale: random.rand() < 0.6 for locale in LOCALES}
+        entities.append({
+            'eid': f'{i:032x}',
+            'label': f'Entity {i}',
+            'tagsets': {
+                locale: [
+                    f'{locale}:tag{j}'
+                    for j in random.choice(100, 3, replace=False)]
+                for locale, available in onehot.items()
+                if available},
+            'onehot': onehot})
+    write(str(directory), entities, LOCALES)
+    return str(directory)
+
+
+def exhaustive(directory, eid, sources, target, k):
+    """ Brute force search over written vectors. """
+    index = SimilarityIndex(directory)
+    row = index._rows[eid]
+    vectors = np.load(f'{directory}/{VECTORS}')
+    flags = np.load(f'{directory}/{FLAGS}')
+    mask = flags[:, LOCALES.index(target)] & np.any(
+        flags[:, [LOCALES.index(source) for source in sources]],
+        axis=1)
+    mask[row] = False
+    scores = vectors @ vectors[row]
+    scores[~mask] = -np.inf
+    return [index._eids[i] for i in np.argsort(-scores)[:k]]
+
+
+def test_search_exhaustive(directory, monkeypatch):
+    """ Probing every cluster matches brute force search. """
+    monkeypatch.setattr(configuration, 'SIMILARITY_PROBES', 3000)
+    index = SimilarityIndex(directory)
+    assert len(index._centroids) > 1
+    for eid in index._eids[::300]:
+        neighbours = index.search(eid, ['fr', 'ja'], 'en', 10)
+        assert [neighbour['eid'] for neighbour in neighbours] == \
+            exhaustive(directory, eid, ['fr', 'ja'], 'en', 10)
+
+
+def test_search_probes(directory, monkeypatch):
+    """ Probing a single cluster still returns k sorted matching entities. """
+    monkeypatch.setattr(configuration, 'SIMILARITY_PROBES', 1)
+    index = SimilarityIndex(directory)
+    flags = np.load(f'{directory}/{FLAGS}')
+    neighbours = index.search(index._eids[0], ['fr'], 'ja', 50)
+    scores = [neighbour['score'] for neighbour in neighbours]
+    assert len(neighbours) == 50
+    assert scores == sorted(scores, reverse=True)
+    for neighbour in neighbours:
+        row = index._rows[neighbour['eid']]
+        assert flags[row, 0] and flags[row, 2]
+
+
+def test_search_errors(directory):
+    """ Unknown entity and locales are reported with distinct errors. """
+    index = SimilarityIndex(directory)
+    with pytest.raises(KeyError):
+        index.search('f' * 32, ['fr'], 'en', 10)
+    with pytest.raises(ValueError):
+        index.search(index._eids[0], ['fr', 'de'], 'en', 10)
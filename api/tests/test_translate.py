@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# coding: utf8
+
+""" Unit tests for batch prediction and bulk translation. """
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import translate
+from src.mapper import GenreMapper
+from src.translate import run, save_checkpoint
+
+TAGS = {
+    locale: [f'{locale}:genre{i}' for i in range(20)]
+    for locale in ('fr', 'es', 'en')}
+""" Tags of each test locale. """
+
+
+@pytest.fixture
+def mapper(monkeypatch):
+    """ `fr-es#en` mapper built from random embeddings similarities. """
+    tags = [tag for values in TAGS.values() for tag in values]
+    similarities = np.random.RandomState(0).rand(len(tags), len(tags))
+    monkeypatch.setattr(
+        GenreMapper,
+        'mappings',
+        pd.DataFrame(similarities, index=tags, columns=tags))
+    monkeypatch.setattr(GenreMapper, 'instances', {})
+    mapper = GenreMapper.get(['fr', 'es'], 'en', TAGS.get)
+    monkeypatch.setattr(translate, 'prepare', lambda sources, target: mapper)
+    monkeypatch.setattr(translate, 'mapper', None)
+    return mapper
+
+
+@pytest.fixture
+def source(tmp_path):
+    """ JSONL catalogue of random tagsets. """
+    random = np.random.RandomState(1)
+    path = tmp_path / 'items.jsonl'
+    with open(path, 'w') as stream:
+        for i in range(57):
+            locale = 'fr' if random.rand() < 0.5 else 'es'
+            tags = [
+                TAGS[locale][j]
+                for j in random.choice(20, random.randint(6), replace=False)]
+            stream.write(json.dumps({'id': str(i), 'tags': tags}) + '\n')
+    return str(path)
+
+
+def test_predict_batch(mapper):
+    """ Batch predictions match per tagset predictions. """
+    batch = [
+        ['fr:genre1'],
+        ['fr:genre2', 'es:genre3', 'es:genre4'],
+        ['es:genre5', 'unknown:tag'],
+        [],
+        ['unknown:tag']]
+    expected = [
+        mapper.predict(
+            [tag for tag in tags if tag in mapper._rows],
+            lambda tag: True)[:5]
+        if any([tag in mapper._rows for tag in tags]) else []
+        for tags in batch]
+    assert mapper.predict_batch(batch, 5) == expected
+
+
+def test_run_resume(mapper, source, tmp_path):
+    """ Interrupted job resumes from checkpoint. """
+    output = str(tmp_path / 'output.jsonl')
+    run(source, output, ['fr', 'es'], 'en', 3, 10, 1)
+    with open(output, 'rb') as stream:
+        expected = stream.read()
+    lines = expected.splitlines(keepends=True)
+    assert len(lines) == 57
+    parameters = {
+        'input': source,
+        'sources': ['fr', 'es'],
+        'target': 'en',
+        'k': 3}
+    save_checkpoint(
+        f'{output}.checkpoint',
+        parameters,
+        20,
+        len(b''.join(lines[:20])))
+    with open(output, 'wb') as stream:
+        stream.write(b''.join(lines[:25]) + b'{"id": "truncat')
+    run(source, output, ['fr', 'es'], 'en', 3, 10, 1)
+    with open(output, 'rb') as stream:
+        assert stream.read() == expected
+
+
+def test_run_mismatch(mapper, source, tmp_path):
+    """ Checkpoint of a job with other parameters is refused. """
+    output = str(tmp_path / 'output.jsonl')
+    run(source, output, ['fr', 'es'], 'en', 3, 10, 1)
+    with pytest.raises(ValueError):
+        run(source, output, ['fr', 'es'], 'en', 5, 10, 1)
+    with pytest.raises(ValueError):
+        run(source, output, ['fr'], 'en', 3, 10, 1)
+
+
+def test_run_prepare_error(source, tmp_path, monkeypatch):
+    """ Mapper errors abort the job before starting workers. """
+    def prepare(sources, target):
+        raise IOError('No artifact bundle published')
+    monkeypatch.setattr(translate, 'prepare', prepare)
+    monkeypatch.setattr(translate, 'Pool', None)
+    with pytest.raises(IOError):
+        run(source, str(tmp_path / 'output.jsonl'), ['fr'], 'en', 3, 10, 1)